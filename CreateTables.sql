@@ -25,7 +25,10 @@ create table if not exists inventory.nics (
   id integer not null auto_increment primary key,
   sid integer,
   mac char(17),
-  comment varchar(80)/*,
+  macnum bigint unsigned, -- The MAC as a 48 bit integer, so that lookups don't depend on how it was written
+  comment varchar(80),
+  index ix_nics_sid (sid),
+  index ix_nics_macnum (macnum)/*,
   foreign key (server_id)
     references inventory.servers(id)
     on update cascade
@@ -35,13 +38,30 @@ create table if not exists inventory.nics (
 create table if not exists inventory.ips (
   id integer not null auto_increment primary key,
   nicid integer,
-  ip varchar(20) /*,
+  ip varchar(20),
+  index ix_ips_nicid (nicid),
+  index ix_ips_ip (ip) /*,
   foreign key (nic_id)
     references inventory.nics(id)
     on update cascade
     on delete cascade */
 );
 
+/*
+  The change log. Every write to a server or NIC adds a row in the same transaction, so the highest ID is the
+  version of the inventory, and consumers can follow the changes after the version they've seen.
+ */
+
+drop table if exists inventory.changes;
+
+create table if not exists inventory.changes (
+  id integer not null auto_increment primary key, -- The version
+  collection varchar(10) not null, -- servers or nics
+  itemid integer not null,
+  action varchar(10) not null, -- created, updated or deleted
+  time double not null -- Unix seconds
+);
+
 /*
   For simple security (rather than using auth tokens) just use username and password.
   Passwords are stored as SHA2 512 bit, as this is natively supported by MySQL
@@ -64,3 +84,6 @@ insert into inventory.users (name, hash) values
 insert into inventory.servers (servicetag, sid, stockid) values ('ABC123', 12345, 54321), ('XYZ123', 12346, 54322);
 insert into nics (sid, mac) values (1, '08:00:2B:12:34:56'),  (2, '08:00:2B:12:34:57');
 insert into ips (nicid, ip)  values (2, '10.0.1.1'), (2, '10.0.1.2');
+
+-- Fill in the integer form of any MACs which don't have it
+update nics set macnum = conv(replace(replace(replace(mac, ':', ''), '-', ''), '.', ''), 16, 10) where macnum is null;
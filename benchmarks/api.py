@@ -0,0 +1,87 @@
+"""
+Load tests the inventory API. Runs server.app in-process against an SQLite stand-in for the inventory
+DB (see inventorydb.py) and fires requests at it from a pool of clients, reporting throughput and
+latency percentiles for each kind of request.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import inventorydb
+
+MinRuns = 100 # For a p99 with a sample above it
+
+Scenarios = {
+    'list': lambda n: '/inventory/api/v1/servers?limit=100&after={}'.format(random.randrange(n)),
+    'server': lambda n: '/inventory/api/v1/server/{}'.format(random.randint(1, n)),
+    'expand': lambda n: '/inventory/api/v1/server/{}?expand=nics.ips'.format(random.randint(1, n)),
+    'mac': lambda n: '/inventory/api/v1/nics?mac={}'.format(inventorydb.MAC(random.randint(1, n), 1)),
+}
+
+def P99(times):
+    """
+    The 99th percentile of `times`, interpolated between the samples either side of it
+    :return: seconds, or None if there are too few samples (fewer than MinRuns) for a p99 to mean anything
+    """
+    if len(times) < MinRuns:
+        return None
+    return statistics.quantiles(times, n=100)[98]
+
+def Milliseconds(seconds, width):
+    return '{:{}.2f}ms'.format(1000 * seconds, width) if seconds is not None else '{:>{}}  '.format('n/a', width)
+
+def Run(baseurl, scenario, servers, clients=8, requests_=1000):
+    """
+    Makes `requests_` requests of the given scenario from `clients` clients at once
+    :return: (seconds taken, list of latencies in seconds, number of failed requests)
+    """
+    local = threading.local()
+    def one(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.session.auth = next(iter(inventorydb.Users.items()))
+        start = time.perf_counter()
+        r = local.session.get(baseurl + Scenarios[scenario](servers))
+        return time.perf_counter() - start, r.status_code != 200
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(one, range(requests_)))
+    return time.perf_counter() - start, [t for t, _ in results], sum(failed for _, failed in results)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s: %(levelname)-8s: %(message)s")
+    ap = argparse.ArgumentParser(description='Load test the inventory API')
+    ap.add_argument("--servers", type=int, default=1000)
+    ap.add_argument("--nics", type=int, default=4)
+    ap.add_argument("--ips", type=int, default=2)
+    ap.add_argument("--clients", type=int, default=8, help="Requests in flight at once")
+    ap.add_argument("--requests", type=int, default=1000, help="Requests per scenario")
+    ap.add_argument("--scenario", action='append', choices=sorted(Scenarios), help="Scenarios to run (default all)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        inventorydb.Setup(os.path.join(directory, 'inventory.db'), args.servers, args.nics, args.ips)
+        import server # After Setup, so that it picks up the SQLite DB
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        baseurl = 'http://127.0.0.1:{}'.format(httpd.server_port)
+        for scenario in args.scenario or Scenarios:
+            seconds, times, failed = Run(baseurl, scenario, args.servers, args.clients, args.requests)
+            print("{:7} {:8.1f} req/s  median {:7.2f}ms  p99 {}  {} failed".format(
+                scenario, len(times) / seconds, 1000 * statistics.median(times), Milliseconds(P99(times), 7), failed))
+        if args.requests < MinRuns:
+            print("p99 needs at least {} requests per scenario".format(MinRuns))
+        httpd.shutdown()
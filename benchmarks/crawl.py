@@ -0,0 +1,54 @@
+"""
+Times crawls of a fleet of fake DRACs (see fakeredfish.py) with client.Fleet, reporting the crawl rate
+and how many requests it took.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import client
+from fakeredfish import FakeRedfishServer
+
+def Crawl(server, hosts, workers=32, timeout=300, **dracargs):
+    """
+    Crawls `hosts` fake DRACs on `server`
+    :return: dict of results
+    """
+    before = dict(server.stats)
+    fleet = client.Fleet(['127.0.0.{}'.format(h) for h in range(1, hosts + 1)], 'root', 'calvin', workers=workers,
+                         timeout=timeout, retain=False, port=server.port, scheme='http', **dracargs)
+    start = time.perf_counter()
+    fleet.crawl(progress=3600)
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for r in fleet.results.values() if r['status'] == 'ok')
+    return {'seconds': elapsed, 'ok': ok, 'hosts/min': 60 * len(fleet.results) / elapsed,
+            'requests': server.stats['requests'] - before['requests'], 'bytes': server.stats['bytes'] - before['bytes']}
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s: %(levelname)-8s: %(message)s")
+    logging.captureWarnings(True)
+    ap = argparse.ArgumentParser(description='Benchmark crawling a fleet of fake DRACs')
+    ap.add_argument("--hosts", type=int, default=50, help="Number of fake DRACs (at most 254)")
+    ap.add_argument("--workers", type=int, default=32, help="DRACs crawled at once")
+    ap.add_argument("--concurrency", type=int, default=4, help="Requests in flight per DRAC")
+    ap.add_argument("--latency", type=float, default=0.05, help="Mean seconds the fake DRACs take to respond")
+    ap.add_argument("--errors", type=float, default=0.0, help="Proportion of requests the fake DRACs fail")
+    ap.add_argument("--no-expand", action='store_true', help="Fake DRACs don't support $expand")
+    ap.add_argument("--nics", type=int, default=4, help="NICs per system")
+    ap.add_argument("--cpus", type=int, default=2, help="CPUs per system")
+    args = ap.parse_args()
+
+    server = FakeRedfishServer(latency=args.latency, errors=args.errors, expand=not args.no_expand,
+                               cpus=args.cpus, nics=args.nics).start()
+    with tempfile.TemporaryDirectory() as cachedir:
+        cache = client.ResponseCache(cachedir)
+        for name in ('cold', 'cached'): # The second run can use the ETags from the first
+            r = Crawl(server, args.hosts, args.workers, concurrency=args.concurrency, cache=cache)
+            print("{:7} {:3}/{} ok in {:6.2f}s  {:8.1f} hosts/min  {:5} requests  {:9} bytes".format(
+                name, r['ok'], args.hosts, r['seconds'], r['hosts/min'], r['requests'], r['bytes']))
+    server.shutdown()
@@ -0,0 +1,76 @@
+"""
+Compares loading a server's full network picture (the server, its NICs and their IP addresses) with
+db.GetServerTree against walking the resources one at a time as a client has to without it. Uses an
+SQLite database so that it runs anywhere.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+import inventorydb
+
+MinRuns = 100 # For a p99 with a sample above it
+
+def Walk(id):
+    """
+    The per-resource walk: the server, then the NICs and IPs lists to find the ones which belong to it
+    """
+    server = db.GetServer(id)
+    server['nics'] = [nic for nic in db.GetNICs() if nic['sid'] == id]
+    nicids = {nic['id']: nic for nic in server['nics']}
+    for nic in server['nics']:
+        nic['ips'] = []
+    for ip in db.GetIPs():
+        if ip.nicid in nicids:
+            nicids[ip.nicid]['ips'].append({'id': ip.id, 'ip': ip.ip})
+    return server
+
+def P99(times):
+    """
+    The 99th percentile of `times`, interpolated between the samples either side of it
+    :return: seconds, or None if there are too few samples (fewer than MinRuns) for a p99 to mean anything
+    """
+    if len(times) < MinRuns:
+        return None
+    return statistics.quantiles(times, n=100)[98]
+
+def Milliseconds(seconds, width):
+    return '{:{}.2f}ms'.format(1000 * seconds, width) if seconds is not None else '{:>{}}  '.format('n/a', width)
+
+def Time(f, ids):
+    times = []
+    queries = []
+    for id in ids:
+        db.Session.remove()
+        db.QueryCount(reset=True)
+        start = time.perf_counter()
+        f(id)
+        times.append(time.perf_counter() - start)
+        queries.append(db.QueryCount())
+    return times, queries
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Benchmark loading a server with its NICs and IPs')
+    ap.add_argument("--servers", type=int, default=1000)
+    ap.add_argument("--nics", type=int, default=4, help="NICs per server")
+    ap.add_argument("--ips", type=int, default=2, help="IPs per NIC")
+    ap.add_argument("--runs", type=int, default=100)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        inventorydb.Setup(os.path.join(directory, 'inventory.db'), args.servers, args.nics, args.ips)
+        ids = [random.randint(1, args.servers) for _ in range(args.runs)]
+        for name, f in (('walk', Walk), ('tree', db.GetServerTree)):
+            times, queries = Time(f, ids)
+            print("{:5} median {:8.2f}ms  p99 {}  {:.0f} queries".format(
+                name, 1000*statistics.median(times), Milliseconds(P99(times), 8), statistics.mean(queries)))
+        if args.runs < MinRuns:
+            print("p99 needs at least {} runs".format(MinRuns))
+        db.Session.remove()
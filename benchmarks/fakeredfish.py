@@ -0,0 +1,221 @@
+"""
+A fake Redfish service, standing in for an iDRAC, which serves a synthetic tree of systems, CPUs, NICs,
+storage controllers and disks over plain HTTP. Latency and errors can be injected to see how the
+crawler copes.
+
+Every address in 127.0.0.0/8 reaches it, and the service tag of each system depends on the address it
+was reached by, so a fleet of fake DRACs can be had from one server - e.g. 127.0.0.1 to 127.0.0.200.
+"""
+
+import argparse
+import hashlib
+import http
+import http.server
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+def BuildTree(host='127.0.0.1', systems=1, cpus=2, nics=4, controllers=1, disks=4, expand=True):
+    """
+    Builds the Redfish resources of a fake DRAC
+    :param host: the address the DRAC was reached by, which is worked into service tags and MACs
+    :param expand: whether the service root advertises $expand support
+    :return: dict of path -> JSON
+    """
+    seed = int(hashlib.sha1(host.encode()).hexdigest()[:8], 16)
+    tree = {}
+    tree['/redfish/v1'] = {
+        '@odata.id': '/redfish/v1',
+        'RedfishVersion': '1.4.0',
+        'Systems': {'@odata.id': '/redfish/v1/Systems'},
+        'SessionService': {'@odata.id': '/redfish/v1/SessionService'},
+        'ProtocolFeaturesSupported': {'ExpandQuery': {'Levels': expand, 'NoLinks': expand, 'MaxLevels': 1},
+                                      'SelectQuery': False},
+    }
+    tree['/redfish/v1/Systems'] = {'@odata.id': '/redfish/v1/Systems', 'Members': []}
+    for s in range(1, systems + 1):
+        sysid = 'System.Embedded.{}'.format(s)
+        syspath = '/redfish/v1/Systems/' + sysid
+        tree['/redfish/v1/Systems']['Members'].append({'@odata.id': syspath})
+        tree[syspath] = {
+            '@odata.id': syspath,
+            'Id': sysid,
+            'Name': 'System',
+            'Description': 'Computer System which corresponds to a machine or partition.',
+            'Manufacturer': 'Dell Inc.',
+            'Model': 'PowerEdge R640',
+            'SKU': '{:07X}'.format((seed + s) % 0x10000000),
+            'SerialNumber': 'CN7{:011}'.format((seed + s) % 10**11),
+            'BiosVersion': '1.4.9',
+            'PowerState': 'On',
+            'MemorySummary': {'TotalSystemMemoryGiB': 192, 'Status': {'Health': 'OK'}},
+            'Processors': {'@odata.id': syspath + '/Processors'},
+            'EthernetInterfaces': {'@odata.id': syspath + '/EthernetInterfaces'},
+            'SimpleStorage': {'@odata.id': syspath + '/SimpleStorage'},
+        }
+        for collection, count, build in (('Processors', cpus, _CPU), ('EthernetInterfaces', nics, _NIC),
+                                         ('SimpleStorage', controllers, lambda n, seed: _Controller(n, seed, disks))):
+            path = '{}/{}'.format(syspath, collection)
+            tree[path] = {'@odata.id': path, 'Members': []}
+            for n in range(1, count + 1):
+                member = build(n, seed + s)
+                member['@odata.id'] = '{}/{}'.format(path, member['Id'])
+                tree[path]['Members'].append({'@odata.id': member['@odata.id']})
+                tree[member['@odata.id']] = member
+    return tree
+
+def _CPU(n, seed):
+    return {'Id': 'CPU.Socket.{}'.format(n), 'Name': 'CPU {}'.format(n), 'Manufacturer': 'Intel',
+            'Model': 'Intel(R) Xeon(R) Gold 6130 CPU @ 2.10GHz', 'TotalCores': 16, 'TotalThreads': 32,
+            'MaxSpeedMHz': 4000, 'Socket': 'CPU.Socket.{}'.format(n), 'Status': {'Health': 'OK', 'State': 'Enabled'}}
+
+def _NIC(n, seed):
+    mac = ':'.join('{:02X}'.format(b) for b in ((seed >> 16) & 0xff, (seed >> 8) & 0xff, seed & 0xff, 0x10, 0x00, n))
+    return {'Id': 'NIC.Integrated.1-{}-1'.format(n), 'Name': 'System Ethernet Interface',
+            'Description': 'Integrated NIC 1 Port {} Partition 1'.format(n), 'MACAddress': mac,
+            'PermanentMACAddress': mac, 'SpeedMbps': 10000, 'LinkStatus': 'LinkUp', 'MTUSize': 1500,
+            'IPv4Addresses': [], 'Status': {'Health': 'OK', 'State': 'Enabled'}}
+
+def _Controller(n, seed, disks):
+    return {'Id': 'RAID.Integrated.{}-1'.format(n), 'Name': 'PERC H740P Mini', 'Description': 'Simple Storage Controller',
+            'Devices': [{'Name': 'Physical Disk 0:1:{}'.format(d), 'Manufacturer': 'SEAGATE', 'Model': 'ST1200MM0099',
+                         'CapacityBytes': 1200243695616, 'Status': {'Health': 'OK', 'State': 'Enabled'}}
+                        for d in range(disks)]}
+
+class FakeRedfishHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the tree built by BuildTree for the address the request arrived on
+    """
+    protocol_version = 'HTTP/1.1' # Keep-alive, as a real iDRAC does
+
+    def log_message(self, format, *args):
+        logging.debug("{} {}".format(self.address_string(), format % args))
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.stats['bytes'] += len(data)
+
+    def _delay(self):
+        """
+        Injects the configured latency and errors. Returns True if an error was sent.
+        """
+        self.server.stats['requests'] += 1
+        if self.server.latency:
+            time.sleep(random.uniform(self.server.latency * 0.5, self.server.latency * 1.5))
+        if self.server.errors and random.random() < self.server.errors:
+            self.server.stats['errors'] += 1
+            self._send(random.choice((http.HTTPStatus.INTERNAL_SERVER_ERROR, http.HTTPStatus.SERVICE_UNAVAILABLE)),
+                       {'error': {'message': 'Injected error'}}, {'Retry-After': '1'})
+            return True
+        return False
+
+    def do_GET(self):
+        if self._delay():
+            return
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path.rstrip('/')
+        tree = self.server.tree(self.connection.getsockname()[0])
+        if path in self.server.failing:
+            self._send(http.HTTPStatus.INTERNAL_SERVER_ERROR, {'error': {'message': 'Broken'}})
+            return
+        if path not in tree:
+            self._send(http.HTTPStatus.NOT_FOUND, {'error': {'message': '{} not found'.format(path)}})
+            return
+        body = tree[path]
+        if '$expand' in urllib.parse.unquote(url.query) and self.server.expand and 'Members' in body:
+            body = dict(body, Members=[tree[m['@odata.id']] for m in body['Members']])
+        etag = '"{}"'.format(hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self._send(http.HTTPStatus.NOT_MODIFIED, headers={'ETag': etag})
+        else:
+            self._send(http.HTTPStatus.OK, body, {'ETag': etag})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self._delay():
+            return
+        if self.path.rstrip('/') == '/redfish/v1/SessionService/Sessions':
+            token = os.urandom(16).hex()
+            self._send(http.HTTPStatus.CREATED, {'Id': token[:8]},
+                       {'X-Auth-Token': token, 'Location': '/redfish/v1/SessionService/Sessions/' + token[:8]})
+        else:
+            self._send(http.HTTPStatus.METHOD_NOT_ALLOWED, {'error': {'message': 'Not allowed'}})
+
+    def do_DELETE(self):
+        if self._delay():
+            return
+        self._send(http.HTTPStatus.OK, {})
+
+class FakeRedfishServer(http.server.ThreadingHTTPServer):
+    """
+    A fake Redfish service. The tree for each address is built when it's first asked for.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, errors=0.0, expand=True, failing=(), **tree):
+        """
+        :param port: port to listen on, on every address. 0 picks a free one.
+        :param latency: mean seconds to wait before answering each request
+        :param errors: proportion of requests to fail with a 500 or 503
+        :param expand: support $expand
+        :param failing: paths which always fail with a 500
+        :param tree: passed to BuildTree - systems, cpus, nics, controllers, disks
+        """
+        super().__init__(('', port), FakeRedfishHandler)
+        self.latency = latency
+        self.errors = errors
+        self.expand = expand
+        self.failing = set(failing)
+        self.treeargs = tree
+        self.trees = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'bytes': 0}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def tree(self, host):
+        with self.lock:
+            if host not in self.trees:
+                self.trees[host] = BuildTree(host, expand=self.expand, **self.treeargs)
+            return self.trees[host]
+
+    def start(self):
+        """
+        Serves requests in a background thread
+        :return: self
+        """
+        threading.Thread(target=self.serve_forever, name='fakeredfish', daemon=True).start()
+        return self
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)-8s: %(message)s")
+    ap = argparse.ArgumentParser(description='Run a fake Redfish service')
+    ap.add_argument("--port", type=int, default=8443)
+    ap.add_argument("--latency", type=float, default=0.0, help="Mean seconds to wait before each response")
+    ap.add_argument("--errors", type=float, default=0.0, help="Proportion of requests to fail")
+    ap.add_argument("--no-expand", action='store_true', help="Don't support $expand")
+    ap.add_argument("--systems", type=int, default=1)
+    ap.add_argument("--cpus", type=int, default=2)
+    ap.add_argument("--nics", type=int, default=4)
+    ap.add_argument("--controllers", type=int, default=1)
+    ap.add_argument("--disks", type=int, default=4)
+    args = ap.parse_args()
+
+    server = FakeRedfishServer(args.port, args.latency, args.errors, not args.no_expand, systems=args.systems,
+                               cpus=args.cpus, nics=args.nics, controllers=args.controllers, disks=args.disks)
+    logging.info("Fake Redfish service listening on port {}".format(server.port))
+    server.serve_forever()
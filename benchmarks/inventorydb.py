@@ -0,0 +1,45 @@
+"""
+A stand-in for the inventory DB: an SQLite database with the same schema, filled with synthetic servers,
+NICs and IP addresses, so that the API can be benchmarked without MySQL.
+"""
+
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+Users = {'tim': 'swordfish123'}
+
+def Setup(filename, servers=1000, nics=4, ips=2):
+    """
+    Points db at a new SQLite database in `filename` and fills it with `servers` servers, each with `nics`
+    NICs, each with `ips` IP addresses, plus the users in Users
+    :return: None
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    db.Configure('sqlite:///{}'.format(filename))
+    db.CreateSchema()
+    with db.GetEngine().begin() as conn:
+        conn.execute(db.User.__table__.insert(), [{'name': u, 'hash': hashlib.sha512(p.encode()).hexdigest().upper()}
+                                                  for u, p in Users.items()])
+        conn.execute(db.Server.__table__.insert(), [{'id': s, 'servicetag': 'T{:06}'.format(s), 'sid': 100000 + s,
+                                                     'stockid': 200000 + s} for s in range(1, servers + 1)])
+        conn.execute(db.NIC.__table__.insert(), [{'id': (s - 1) * nics + n, 'sid': s, 'mac': MAC(s, n), 'macnum': db.MACToInt(MAC(s, n))}
+                                                 for s in range(1, servers + 1) for n in range(1, nics + 1)])
+        conn.execute(db.IP.__table__.insert(), [{'nicid': n, 'ip': IP(n, i)}
+                                                for n in range(1, servers * nics + 1) for i in range(ips)])
+
+def MAC(server, nic):
+    """
+    The MAC address Setup gives NIC number `nic` of server `server`
+    """
+    return '08:00:2B:{:02X}:{:02X}:{:02X}'.format(server >> 8 & 0xff, server & 0xff, nic)
+
+def IP(nicid, n):
+    """
+    The `n`th IP address Setup gives the NIC with ID `nicid`
+    """
+    return '10.{}.{}.{}'.format(nicid >> 8 & 0xff, nicid & 0xff, n + 1)
@@ -0,0 +1,58 @@
+"""
+Compares serialising a list of servers or NICs with flask_restful's marshal, as the list endpoints used to,
+against server.RowEncoder, and checks that the JSON they give is byte for byte the same.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask_restful import marshal
+import server
+import inventorydb
+
+def Rows(kind, n):
+    """
+    Makes `n` rows like those db.GetServers or db.GetNICs return
+    """
+    if kind == 'server':
+        return [{'id': i, 'tag': 'T{:06}'.format(i), 'sid': 100000 + i, 'stockid': 200000 + i,
+                 'comment': None if i % 3 else 'Rack {}'.format(i % 40)} for i in range(1, n + 1)]
+    return [{'id': i, 'mac': inventorydb.MAC(i // 4, i % 4), 'sid': i // 4, 'comment': None} for i in range(1, n + 1)]
+
+def Time(f, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Benchmark serialising lists of rows')
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    with server.app.test_request_context():
+        for kind, spec, encoder in (('server', server.server_fields, server.server_encoder),
+                                    ('nic', server.nic_fields, server.nic_encoder)):
+            rows = Rows(kind, args.rows)
+            old = json.dumps({kind: [marshal(row, spec) for row in rows]})
+            encode = encoder.bind()
+            new = json.dumps({kind: [encode(row) for row in rows]})
+            if old != new:
+                sys.exit("RowEncoder output for {}s differs from marshal".format(kind))
+            def Encode(dumps=json.dumps):
+                encode = encoder.bind() # Once per request, as ListResponse does
+                return dumps({kind: [encode(row) for row in rows]})
+            results = [('marshal', Time(lambda: json.dumps({kind: [marshal(row, spec) for row in rows]}), args.runs)),
+                       ('encoder', Time(Encode, args.runs))]
+            if server.orjson is not None:
+                results.append(('orjson', Time(lambda: Encode(server.orjson.dumps), args.runs)))
+            for name, seconds in results:
+                print("{:6} {:7} {:8.1f}ms  {:10.0f} rows/s".format(kind, name, 1000 * seconds, args.rows / seconds))
@@ -0,0 +1,38 @@
+"""
+Measures how long it takes a fresh Python process to import the API modules. Nothing should
+need to talk to the DB at import time, so this runs without one.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def ImportTime(module, runs=10):
+    """
+    Imports `module` in `runs` fresh interpreters and returns the times taken in seconds, less the
+    time taken to start an interpreter which imports nothing
+    :return: list of float
+    """
+    def timed(code):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+        return time.perf_counter() - start
+
+    baseline = statistics.median(timed('pass') for _ in range(runs))
+    return [timed('import {}'.format(module)) - baseline for _ in range(runs)]
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Benchmark the import (cold start) time of the API modules')
+    ap.add_argument("--runs", type=int, default=10, help="Number of runs per module")
+    ap.add_argument("modules", nargs='*', default=['db', 'server'], help="Modules to import")
+    args = ap.parse_args()
+
+    for module in args.modules:
+        times = ImportTime(module, args.runs)
+        print("{:10} median {:7.1f}ms  min {:7.1f}ms  max {:7.1f}ms".format(
+            module, 1000*statistics.median(times), 1000*min(times), 1000*max(times)))
@@ -0,0 +1,89 @@
+"""
+Compares the memory use and construction speed of client.Subsystem objects against the original
+__dict__ based implementation, using synthetic Redfish NIC resources.
+"""
+
+import argparse
+import os
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import client
+
+class LegacySubsystem:
+    """
+    The original implementation of client.Subsystem, for comparison
+    """
+    IgnoreAttributes = ['IgnoreAttributes', 'Description']
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            if self._isvalid(k, v):
+                setattr(self, k, v)
+
+    def _isvalid(self, k, v):
+        if v is None or isinstance(v, dict) or isinstance(v,list):
+            return False
+        for c in k:
+            if c not in string.ascii_letters + string.digits:
+                return False
+        if k.upper in [w.upper() for w in LegacySubsystem.IgnoreAttributes]:
+            return False
+        return True
+
+def NICJSON(n):
+    """
+    Returns something resembling the Redfish EthernetInterface resource of an iDRAC
+    """
+    mac = ':'.join('{:02X}'.format((n >> s) & 0xff) for s in range(40, -8, -8))
+    return {
+        '@odata.context': '/redfish/v1/$metadata#EthernetInterface.EthernetInterface',
+        '@odata.id': '/redfish/v1/Systems/System.Embedded.1/EthernetInterfaces/NIC.Integrated.1-{}-1'.format(n % 4),
+        '@odata.type': '#EthernetInterface.v1_4_0.EthernetInterface',
+        'AutoNeg': True,
+        'Description': 'Integrated NIC 1 Port {} Partition 1'.format(n % 4),
+        'EthernetInterfaceType': 'Physical',
+        'FQDN': None,
+        'FullDuplex': True,
+        'HostName': None,
+        'IPv4Addresses': [],
+        'IPv6Addresses': [],
+        'Id': 'NIC.Integrated.1-{}-1'.format(n % 4),
+        'InterfaceEnabled': True,
+        'Links': {'Chassis': {'@odata.id': '/redfish/v1/Chassis/System.Embedded.1'}},
+        'LinkStatus': 'LinkUp',
+        'MACAddress': mac,
+        'MTUSize': 1500,
+        'Name': 'System Ethernet Interface',
+        'PermanentMACAddress': mac,
+        'SpeedMbps': 10000,
+        'Status': {'Health': 'OK', 'State': 'Enabled'},
+        'UefiDevicePath': 'PciRoot(0x0)/Pci(0x1C,0x0)/Pci(0x0,0x{:X})'.format(n % 4),
+    }
+
+def Measure(cls, resources):
+    """
+    Builds an object of class `cls` from each resource
+    :return: (seconds taken, bytes allocated)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = [cls(**r) for r in resources]
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return elapsed, size
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Benchmark Subsystem objects')
+    ap.add_argument("--objects", type=int, default=100000)
+    args = ap.parse_args()
+
+    resources = [NICJSON(n) for n in range(args.objects)]
+    for name, cls in (('legacy', LegacySubsystem), ('compact', client.NIC)):
+        elapsed, size = Measure(cls, resources)
+        print("{:8} {:8.0f} objects/s  {:6.0f} bytes/object".format(name, args.objects / elapsed, size / args.objects))
@@ -0,0 +1,351 @@
+"""
+Bulk import and export of the inventory DB's servers, NICs and IP addresses as CSV or JSON lines.
+
+Rows are streamed in and out in batches of a fixed size, so memory use doesn't grow with the size of the
+file or the table. Each batch is written with a single executemany (which MySQL Connector turns into a
+multi-row INSERT) and committed on its own, and the line reached is saved to a checkpoint file after each
+commit, so an import which fails part way can be fixed and run again to carry on from where it stopped.
+Servers and NICs inserted are added to the change log in the same transaction as the batch. A dry run checks every row without writing anything.
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import ipaddress
+import json
+import logging
+import os
+import sys
+import time
+
+import sqlalchemy.exc
+from sqlalchemy import func, select
+
+import db
+
+Tables = {'servers': db.Server.__table__, 'nics': db.NIC.__table__, 'ips': db.IP.__table__}
+
+
+class RowError(ValueError):
+    """
+    Raised for a row which can't be imported
+    """
+    def __init__(self, line, message):
+        super().__init__("Line {}: {}".format(line, message))
+        self.line = line
+
+
+def _Int(row, column, required=False):
+    value = row.get(column)
+    if value is None or value == '':
+        if required:
+            raise ValueError("No {}".format(column))
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("{} {!r} isn't an integer".format(column, value))
+
+def _Str(row, column, length, required=False):
+    value = row.get(column)
+    if value is None or value == '':
+        if required:
+            raise ValueError("No {}".format(column))
+        return None
+    value = str(value)
+    if len(value) > length:
+        raise ValueError("{} {!r} is longer than {} characters".format(column, value, length))
+    return value
+
+def CheckServer(row):
+    """
+    Checks a server row and converts it to what goes in the table
+    :raises ValueError: if it isn't valid
+    """
+    return {'id': _Int(row, 'id'), 'servicetag': _Str(row, 'servicetag', 10, True), 'sid': _Int(row, 'sid', True),
+            'stockid': _Int(row, 'stockid', True), 'comment': _Str(row, 'comment', 80)}
+
+def CheckNIC(row):
+    """
+    Checks a NIC row and converts it to what goes in the table. macnum is worked out from mac.
+    :raises ValueError: if it isn't valid
+    """
+    mac = _Str(row, 'mac', 17, True)
+    return {'id': _Int(row, 'id'), 'sid': _Int(row, 'sid', True), 'mac': mac, 'macnum': db.MACToInt(mac),
+            'comment': _Str(row, 'comment', 80)}
+
+def CheckIP(row):
+    """
+    Checks an IP address row and converts it to what goes in the table
+    :raises ValueError: if it isn't valid
+    """
+    ip = _Str(row, 'ip', 20, True)
+    ipaddress.ip_address(ip)
+    return {'id': _Int(row, 'id'), 'nicid': _Int(row, 'nicid', True), 'ip': ip}
+
+Checks = {'servers': CheckServer, 'nics': CheckNIC, 'ips': CheckIP}
+Unique = {'servers': ('id', 'servicetag', 'sid', 'stockid'), 'nics': ('id',), 'ips': ('id',)}
+Keys = {'servers': 'servicetag', 'nics': 'macnum'} # What finds the rows the DB numbered. IPs aren't in the change log.
+
+
+def Format(filename, format=None):
+    """
+    Works out the format of a file from its name (e.g. servers.csv, nics.jsonl.gz) unless given
+    :return: 'csv' or 'jsonl'
+    """
+    if format:
+        return format
+    name = filename[:-3] if filename.endswith('.gz') else filename
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+def Open(filename, mode):
+    """
+    Opens a file as text, gzipped if its name ends in .gz. - is stdin or stdout.
+    """
+    if filename == '-':
+        return io.TextIOWrapper(sys.stdin.buffer if 'r' in mode else sys.stdout.buffer, newline='')
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', newline='')
+    return open(filename, mode, newline='')
+
+def ReadRows(f, format):
+    """
+    Yields (line number, dict) for each row in a CSV or JSON lines file
+    """
+    if format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for n, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    raise RowError(n, "Bad JSON: {}".format(e))
+                if not isinstance(row, dict):
+                    raise RowError(n, "Not a JSON object")
+                yield n, row
+
+
+class Checkpoint:
+    """
+    Where an import has got to, kept in a file so that it can be carried on after a failure
+    """
+    def __init__(self, filename, table, source):
+        self.filename = filename
+        self.table = table
+        self.source = source
+        self.line = 0 # Last line of the source which has been committed
+        self.rows = 0
+        if filename and os.path.exists(filename):
+            with open(filename) as f:
+                saved = json.load(f)
+            if saved.get('table') == table and saved.get('source') == source:
+                self.line = saved['line']
+                self.rows = saved['rows']
+                logging.info("Resuming import of {} into {} after line {} ({} rows already imported)".format(
+                    source, table, self.line, self.rows))
+            else:
+                logging.warning("Checkpoint {} is for {} into {}. Starting afresh".format(filename, saved.get('source'), saved.get('table')))
+
+    def save(self, line, rows):
+        self.line = line
+        self.rows += rows
+        if self.filename:
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'table': self.table, 'source': self.source, 'line': self.line, 'rows': self.rows}, f)
+            os.replace(tmp, self.filename)
+
+    def finish(self):
+        if self.filename and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def Batches(rows, size):
+    """
+    Groups an iterable into lists of up to `size` items
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _LastID(conn, table):
+    """
+    Returns the highest ID in a table (0 if it's empty) if it has rows the DB will number, else None
+    """
+    if table not in Keys:
+        return None
+    t = Tables[table]
+    return conn.execute(select(func.coalesce(func.max(t.c.id), 0))).scalar()
+
+def _InsertedIDs(conn, table, values, before):
+    """
+    Works out the IDs of a batch of rows just inserted, as an executemany doesn't return them. Rows without an
+    ID are found by their service tag or MAC among those numbered after `before`.
+    :return: sorted list of IDs
+    """
+    ids = {r['id'] for r in values if r.get('id') is not None}
+    if len(ids) < len(values):
+        t = Tables[table]
+        key = t.c[Keys[table]]
+        numbered = {r[key.name] for r in values if r.get('id') is None}
+        ids.update(id for id, in conn.execute(select(t.c.id).where(t.c.id > before, key.in_(numbered))))
+    return sorted(ids)
+
+def Import(table, filename, format=None, batch=1000, checkpoint=None, dryrun=False, upsert=False):
+    """
+    Imports rows from a file into a table, `batch` rows per transaction
+    :param table: 'servers', 'nics' or 'ips'
+    :param checkpoint: name of a checkpoint file. If it's there from an earlier import of the same file into the
+                       same table, rows up to the line it got to are skipped. It's removed when the import finishes.
+    :param dryrun: only check the rows
+    :param upsert: create or update servers (matching on service tag) or NICs (matching on MAC) with
+                   db.UpsertServers/UpsertNICs rather than inserting them. IDs in the file are ignored.
+    :return: dict with the number of rows read and imported, and a list of errors
+    :raises RowError: for the first bad row, unless it's a dry run
+    """
+    if upsert and table == 'ips':
+        raise ValueError("IP addresses can only be inserted")
+    format = Format(filename, format)
+    check = Checks[table]
+    point = Checkpoint(None if dryrun else checkpoint, table, os.path.abspath(filename) if filename != '-' else '-')
+    seen = {column: set() for column in Unique[table]} if dryrun else None
+    stats = {'read': 0, 'imported': point.rows, 'errors': []}
+    start = time.perf_counter()
+
+    def rows(f):
+        for line, row in ReadRows(f, format):
+            if line <= point.line:
+                continue
+            stats['read'] += 1
+            try:
+                checked = check(row)
+                if seen is not None:
+                    for column, values in seen.items():
+                        if checked[column] is not None:
+                            if checked[column] in values:
+                                raise ValueError("Duplicate {} {!r}".format(column, checked[column]))
+                            values.add(checked[column])
+            except ValueError as e:
+                if not dryrun:
+                    raise RowError(line, e)
+                stats['errors'].append(str(RowError(line, e)))
+                continue
+            yield line, checked
+
+    with Open(filename, 'r') as f:
+        for chunk in Batches(rows(f), batch):
+            if dryrun:
+                continue
+            values = [row for _, row in chunk]
+            if upsert:
+                results = (db.UpsertServers if table == 'servers' else db.UpsertNICs)(
+                    [{'tag': r['servicetag'], 'sid': r['sid'], 'stockid': r['stockid'], 'comment': r['comment']}
+                     if table == 'servers' else r for r in values])
+                db.Session.remove()
+                conflicts = ["Line {}: {}".format(line, r['error']) for (line, _), r in zip(chunk, results) if r['status'] == 'conflict']
+                stats['errors'].extend(conflicts)
+                imported = len(values) - len(conflicts)
+            else:
+                if all(r['id'] is None for r in values):
+                    values = [{k: v for k, v in r.items() if k != 'id'} for r in values] # Let the DB number them
+                try:
+                    with db.GetEngine().begin() as conn:
+                        before = _LastID(conn, table)
+                        conn.execute(Tables[table].insert(), values)
+                        if table in Keys:
+                            db._LogChanges(conn, table, 'created', _InsertedIDs(conn, table, values, before))
+                except sqlalchemy.exc.IntegrityError as e:
+                    raise RowError(chunk[0][0], "Batch of lines {}-{} failed: {}".format(chunk[0][0], chunk[-1][0], e.orig))
+                if table in Keys:
+                    db._Changed(table)
+                imported = len(values)
+            point.save(chunk[-1][0], imported)
+            stats['imported'] = point.rows
+            logging.info("Imported {} rows into {} (line {})".format(point.rows, table, point.line))
+    if not dryrun:
+        point.finish()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+def Export(table, filename, format=None, batch=1000):
+    """
+    Writes every row of a table to a file, in ID order, fetching `batch` rows at a time by keyset pagination
+    (WHERE id > last ORDER BY id LIMIT batch), as MySQL Connector has no server-side cursors to stream from
+    :return: number of rows written
+    """
+    format = Format(filename, format)
+    t = Tables[table]
+    columns = [c.name for c in t.columns]
+    count = 0
+    last = None
+    with Open(filename, 'w') as f:
+        writer = csv.DictWriter(f, columns) if format == 'csv' else None
+        if writer:
+            writer.writeheader()
+        while True:
+            query = select(t).order_by(t.c.id).limit(batch)
+            if last is not None:
+                query = query.where(t.c.id > last)
+            with db.GetEngine().connect() as conn:
+                rows = conn.execute(query).fetchall()
+            for row in rows:
+                row = dict(zip(columns, row))
+                if writer:
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(row) + '\n')
+            count += len(rows)
+            if len(rows) < batch:
+                break
+            last = rows[-1][columns.index('id')]
+    return count
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)-8s: %(message)s")
+    ap = argparse.ArgumentParser(description='Bulk import and export of the inventory DB')
+    ap.add_argument("--db", metavar='url', help="SQLAlchemy URL of the DB")
+    ap.add_argument("--format", choices=('csv', 'jsonl'), help="File format (default from the file name)")
+    ap.add_argument("--batch", type=int, default=1000, help="Rows per batch")
+    sub = ap.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('import', help="Import rows from a file")
+    p.add_argument("table", choices=sorted(Tables))
+    p.add_argument("filename", help="CSV or JSON lines file, optionally .gz. - for stdin.")
+    p.add_argument("--checkpoint", metavar='filename', help="Save progress here, and carry on from it if it's there")
+    p.add_argument("--dry-run", action='store_true', help="Only check the rows")
+    p.add_argument("--upsert", action='store_true', help="Create or update servers by service tag or NICs by MAC")
+    p = sub.add_parser('export', help="Export a table to a file")
+    p.add_argument("table", choices=sorted(Tables))
+    p.add_argument("filename", help="CSV or JSON lines file, optionally .gz. - for stdout.")
+    args = ap.parse_args()
+
+    if args.db:
+        db.Configure(args.db)
+    if args.command == 'export':
+        start = time.perf_counter()
+        count = Export(args.table, args.filename, args.format, args.batch)
+        logging.info("Exported {} rows from {} in {:.1f}s".format(count, args.table, time.perf_counter() - start))
+    else:
+        try:
+            stats = Import(args.table, args.filename, args.format, args.batch, args.checkpoint, args.dry_run, args.upsert)
+        except RowError as e:
+            logging.critical("{}. Fix it and run again{}".format(e, " to carry on from the checkpoint" if args.checkpoint else ""))
+            sys.exit(1)
+        for error in stats['errors']:
+            logging.error(error)
+        if args.dry_run:
+            logging.info("Checked {} rows for {} in {:.1f}s, {} errors".format(
+                stats['read'], args.table, stats['seconds'], len(stats['errors'])))
+        else:
+            logging.info("Imported {} rows into {} ({} read this run) in {:.1f}s, {} errors".format(
+                stats['imported'], args.table, stats['read'], stats['seconds'], len(stats['errors'])))
+        if stats['errors']:
+            sys.exit(1)
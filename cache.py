@@ -0,0 +1,64 @@
+"""
+Simple in-process caches for the API server.
+"""
+
+import collections
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Thread safe least-recently-used cache holding at most `maxsize` entries, each of which expires
+    `ttl` seconds after it was stored (never if `ttl` is None). Counts hits and misses.
+    """
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict() # key -> (expiry, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "{} entries (max {}), {} hits, {} misses".format(len(self.entries), self.maxsize, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for `key`, or `default` if there isn't one or it has expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """
+        Stores `value` for `key`, evicting the least recently used entry if the cache is full
+        """
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expiry, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, match=None):
+        """
+        Removes the entries whose keys `match` returns True for, or all of them if `match` is None
+        """
+        with self.lock:
+            if match is None:
+                self.entries.clear()
+            else:
+                for key in [k for k in self.entries if match(k)]:
+                    del self.entries[key]
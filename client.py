@@ -4,6 +4,7 @@ to the DRAC and to the backend DB.
 """
 
 import requests
+import requests.adapters
 import argparse
 import logging
 import configparser
@@ -11,89 +12,140 @@ import urllib.parse
 import http
 import os.path
 import string
+import threading
+import concurrent.futures
+import queue
+import random
+import time
+import json
+import hashlib
+import os
+import re
+import signal
+import sys
+import email.utils
+import gzip
+import bz2
+import lzma
 
-class Subsystem:
+import metrics
+from history import History
+
+class Subsystem(tuple):
     """
     Generic template to be used as the parent class for various subsystems - e.g. NICs
+
+    Objects are kept compact, as a fleet crawl makes a lot of them. Rather than each having a __dict__,
+    each object is a tuple of attribute values, indexed by a schema of attribute names which is shared
+    by every object of the class and grows as new names are seen. Whether a key is wanted is also worked
+    out once per class, not once per object.
     """
+    __slots__ = ()
 
     IgnoreAttributes = ['IgnoreAttributes', 'Description'] # Attributes to ignore from the class
+    Select = None # Properties to ask for with $select when expanding a collection. None means all of them.
+    ValidKey = re.compile(r'[A-Za-z][A-Za-z0-9]*\Z').match
+    _schema = {} # Per class - see __init_subclass__
+    _keys = {}
+    _lock = threading.Lock()
 
-    def __init__(self, **kwargs):
-        for k, v in kwargs.items():
-            if self._isvalid(k, v):
-                setattr(self, k, v)
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._schema = {} # attribute name -> index into the tuple
+        cls._keys = {} # key -> index into the tuple, or None if we don't want it
+        cls._lock = threading.Lock()
 
-
-    def __repr__(self):
-        s = []
-        for k in dir(self):
-            if (k[0] not in string.ascii_letters) or (k.upper() in [w.upper() for w in Subsystem.IgnoreAttributes]):
+    def __new__(cls, **kwargs):
+        keys = cls._keys
+        values = [None] * len(cls._schema) # None means not present, as we never keep None values
+        for k, v in kwargs.items():
+            if v is None or isinstance(v, (dict, list)):
+                continue
+            try:
+                i = keys[k]
+            except KeyError:
+                i = cls._addkey(k)
+            if i is None:
                 continue
-            s.append("{:20} = {}".format(k, getattr(self, k)))
-        return "\n".join(s)
+            if i >= len(values):
+                values.extend([None] * (i + 1 - len(values)))
+            values[i] = v
+        return super().__new__(cls, values)
 
-    def _isvalid(self, k, v):
+    @classmethod
+    def _addkey(cls, k):
         """
-        Determines whether a particular key/value (from kwargs) should be included in the
-        object's attributes.
+        Decides whether key `k` should be included in the objects' attributes and, if so, adds it to the
+        schema. So...
 
-        So...
+        1. Only allow keys which consist of ASCII letters and digits, starting with a letter
+        2. Don't allow certain banal keys on a list.
 
-        1. Don't allow values which are lists or dicts
-        2. Only allow keys which consist of ASCII letters
-        3. Don't allow certain banal keys on a list.
+        (Values which are None, lists or dicts are never included either.)
         :param k: Key
-        :param v: Value
-        :return: bool
+        :return: index into the tuple, or None if the key isn't wanted
         """
-        if v is None or isinstance(v, dict) or isinstance(v,list):
-            return False
+        with cls._lock:
+            if k not in cls._keys:
+                if cls.ValidKey(k) and k.upper() not in {w.upper() for w in cls.IgnoreAttributes}:
+                    cls._keys[k] = cls._schema.setdefault(k, len(cls._schema))
+                else:
+                    cls._keys[k] = None
+            return cls._keys[k]
 
-        for c in k:
-            if c not in string.ascii_letters + string.digits:
-                return False
+    def __getattr__(self, name):
+        i = type(self)._schema.get(name)
+        if i is not None and i < len(self) and self[i] is not None:
+            return self[i]
+        raise AttributeError("{} has no attribute {}".format(type(self).__name__, name))
 
-        if k.upper in [w.upper() for w in Subsystem.IgnoreAttributes]:
-            return False
+    def attributes(self):
+        """
+        Returns the object's attributes
+        :return: dict
+        """
+        return {k: self[i] for k, i in type(self)._schema.items() if i < len(self) and self[i] is not None}
 
-        return True
+    def __repr__(self):
+        return "\n".join("{:20} = {}".format(k, v) for k, v in sorted(self.attributes().items()))
 
 
 class NIC(Subsystem):
     """
     Network interface
     """
-    pass
+    __slots__ = ()
 
 class SC(Subsystem):
     """
     Storage controller
     """
-    pass
+    __slots__ = ()
 
 class CPU(Subsystem):
     """
     CPU
     """
-    pass
+    __slots__ = ()
 
 class Disk(Subsystem):
     """
     Disk or other storage device subtended from a storage controller
     """
-    pass
+    __slots__ = ()
 
 class System:
     """
     A System as returned by Redfish
     """
     ignoretags = ['Description']
-    def __init__(self, parent, json):
+    subtrees = [('Processors', 'CPU', CPU), ('EthernetInterfaces', 'Ethernet Interfaces', NIC), ('SimpleStorage', 'Simple Storage', SC)]
+    def __init__(self, parent, json, name=None):
         self.parent = parent # The parent DRAC
-        self.json = json
+        self.name = name
+        self.json = json if parent.keepjson else None # Only kept if asked for, as it's big
         self.tags = []
-        for k, v in self.json.items():
+        for k, v in json.items():
             if not isinstance(v, str) or k[0] not in string.ascii_letters or k in System.ignoretags:
                 continue
             setattr(self, k, v)
@@ -101,31 +153,62 @@ class System:
         try:
             self.MemoryGB = json['MemorySummary']['TotalSystemMemoryGiB']
         except KeyError:
-            logging.error("Error getting memory size for {}".format(self.id))
+            logging.error("Error getting memory size for {}".format(self.name))
         else:
             self.tags.append('MemoryGB')
+        self.parent.emit(self.name, 'system', self.name, {t: getattr(self, t) for t in self.tags})
 
-        # Now get the information on the CPUs. Has to handle multiples, so we have a dictionary of
-        # Processor objects...
-
-        self.cpus={}
-        try:
-            self.getcpus(json['Processors']['@odata.id'])
-        except KeyError as e:
-            logging.error("Can't get CPU URL: {}".format(e))
+        # Now get the information on the CPUs, NICs and storage. Each has to handle multiples, so we
+        # have a dictionary of objects per subsystem. The three subtrees are independent of each other
+        # so their collections, and then all of their members, are fetched concurrently. If the DRAC
+        # supports $expand each collection comes back with its members inline and that second step
+        # is only needed for collections which didn't.
 
+        self.cpus = {}
         self.nics = {}
-        try:
-            self.getnics(json['EthernetInterfaces']['@odata.id'])
-        except KeyError as e:
-            logging.error("Can't get Ethernet Interfaces URL: {}".format(e))
-
         self.storagecontrollers = {}
         self.disks = [] # Yes a list, as they don't have identifiers supplied by the DRAC
-        try:
-            self.getstoragecontrollers(json['SimpleStorage']['@odata.id'])
-        except KeyError as e:
-            logging.error("Can't get Simple Storage URL: {}".format(e))
+
+        paths = {}
+        queries = {}
+        for key, name, cls in System.subtrees:
+            try:
+                paths[key] = json[key]['@odata.id']
+            except KeyError as e:
+                logging.error("Can't get {} URL: {}".format(name, e))
+            else:
+                queries[key] = self.parent.expandquery(cls.Select)
+
+        # A collection or member which can't be fetched is logged and left out, rather than failing the crawl
+        collections = dict(zip(paths.keys(), self.parent.getmany((paths[k] + queries[k] for k in paths), tolerate=True)))
+        members = {}
+        memberpaths = {}
+        for key, collection in collections.items():
+            if isinstance(collection, RedfishError) and queries[key] and not isinstance(collection, CircuitOpen):
+                logging.warning("Expanded GET of {} failed. Falling back to fetching it unexpanded".format(paths[key]))
+                collection = self.parent.getmany([paths[key]], tolerate=True)[0]
+            if isinstance(collection, RedfishError):
+                logging.error("Can't get {} of {}: {}".format(key, self.name, collection))
+                self.parent.errors += 1
+                continue
+            if all(len(m) > 1 for m in collection['Members']):
+                members[key] = [(m['@odata.id'], m) for m in collection['Members']]
+            else:
+                memberpaths[key] = [m['@odata.id'] for m in collection['Members']]
+        details = iter(self.parent.getmany([p for key in memberpaths for p in memberpaths[key]], tolerate=True))
+        members.update({key: [(p, next(details)) for p in memberpaths[key]] for key in memberpaths})
+        for key in members:
+            for path, error in [(p, j) for p, j in members[key] if isinstance(j, RedfishError)]:
+                logging.error("Can't get {}: {}".format(path, error))
+                self.parent.errors += 1
+            members[key] = [(p, j) for p, j in members[key] if not isinstance(j, RedfishError)]
+
+        if 'Processors' in members:
+            self.getcpus(members['Processors'])
+        if 'EthernetInterfaces' in members:
+            self.getnics(members['EthernetInterfaces'])
+        if 'SimpleStorage' in members:
+            self.getstoragecontrollers(members['SimpleStorage'])
 
 
     def __repr__(self):
@@ -144,53 +227,320 @@ class System:
             s += "\n{}".format(d)
         return s
 
-    def getcpus(self, path):
+    def getcpus(self, members):
         """
-        Gets the list of CPUs and the details for each
+        Creates the CPUs from the (path, json) pairs of the members of the Processors collection
         """
-        cpusjson = self.parent.get(path)
-        for cpuid, cpujson in enumerate(cpusjson['Members'],1):
-            cpudetailsjson = self.parent.get(cpujson['@odata.id'])
-            cpuname = os.path.split(cpujson['@odata.id'])[1]
+        for path, cpudetailsjson in members:
+            cpuname = os.path.split(path)[1]
             self.cpus[cpuname] = CPU(**cpudetailsjson)
+            self.parent.emit(self.name, 'cpu', cpuname, self.cpus[cpuname].attributes())
 
-    def getnics(self, path):
+    def getnics(self, members):
         """
-        Gets the list of NICSs and the details for each
+        Creates the NICs from the (path, json) pairs of the members of the EthernetInterfaces collection
         """
-        nicsjson = self.parent.get(path)
-        for nicid, nicjson in enumerate(nicsjson['Members'],1):
-            nicdetailsjson = self.parent.get(nicjson['@odata.id'])
-            nicname = os.path.split(nicjson['@odata.id'])[1]
+        for path, nicdetailsjson in members:
+            nicname = os.path.split(path)[1]
             self.nics[nicname] = NIC(**nicdetailsjson)
+            self.parent.emit(self.name, 'nic', nicname, self.nics[nicname].attributes())
 
 
-    def getstoragecontrollers(self, path):
-        scsjson = self.parent.get(path)
-        for scid, scjson in enumerate(scsjson['Members'],1):
-            scdetailsjson = self.parent.get(scjson['@odata.id'])
-            scname = os.path.split(scjson['@odata.id'])[1]
+    def getstoragecontrollers(self, members):
+        """
+        Creates the storage controllers, and the disks hanging off them, from the (path, json) pairs
+        of the members of the SimpleStorage collection
+        """
+        for path, scdetailsjson in members:
+            scname = os.path.split(path)[1]
             logging.debug("SC {}: {}".format(scname, scdetailsjson))
-            self.storagecontrollers[scname] = NIC(**scdetailsjson)
+            self.storagecontrollers[scname] = SC(**scdetailsjson)
+            self.parent.emit(self.name, 'storagecontroller', scname, self.storagecontrollers[scname].attributes())
             for device in scdetailsjson['Devices']:
                 self.disks.append(Disk(**device))
+                self.parent.emit(self.name, 'disk', str(len(self.disks) - 1), self.disks[-1].attributes())
+
+class JSONLWriter:
+    """
+    Writes records as JSON lines to stdout or a file, compressing it if the name ends in .gz, .bz2 or .xz.
+    Safe to share between threads, so one writer can take the output of a whole fleet crawl.
+    """
+    Openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+    def __init__(self, filename='-'):
+        self.filename = filename
+        if filename == '-':
+            self.file = sys.stdout
+        else:
+            opener = JSONLWriter.Openers.get(os.path.splitext(filename)[1], open)
+            self.file = opener(filename, 'wt')
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is sys.stdout:
+                self.file.flush()
+            else:
+                self.file.close()
+        logging.debug("Wrote {} records to {}".format(self.count, self.filename))
+
+class ResponseCache:
+    """
+    On-disk cache of Redfish responses and their ETags, keyed by host and path, so that repeat crawls
+    can use conditional GETs. Bounded to `maxbytes` on disk, least recently used entries being evicted first.
+    """
+    def __init__(self, directory, maxbytes=64*1024*1024):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.entries = {} # filename -> [size, last used]
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith('.json'):
+                st = entry.stat()
+                self.entries[entry.name] = [st.st_size, st.st_mtime]
+        self.size = sum(e[0] for e in self.entries.values())
+
+    def __repr__(self):
+        return "{}: {} entries, {} bytes, {} hits, {} misses".format(self.directory, len(self.entries), self.size,
+                                                                    self.hits, self.misses)
+
+    def _filename(self, host, path):
+        return hashlib.sha1("{}{}".format(host, path).encode()).hexdigest() + '.json'
+
+    def get(self, host, path):
+        """
+        Returns the cached {'etag', 'body'} for host and path, or None
+        :return: dict
+        """
+        name = self._filename(host, path)
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries[name][1] = time.time()
+        try:
+            with open(os.path.join(self.directory, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("Discarding unreadable cache entry for {}{}: {}".format(host, path, e))
+            self.discard(host, path)
+
+    def record(self, hit):
+        """
+        Counts a lookup which was (`hit` True) or wasn't answered from the cache. Called from the crawl threads.
+        :return: None
+        """
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, host, path, etag, body):
+        """
+        Stores a response in the cache, evicting the least recently used entries if it's over size
+        :return: None
+        """
+        name = self._filename(host, path)
+        data = json.dumps({'host': host, 'path': path, 'etag': etag, 'body': body}).encode()
+        filename = os.path.join(self.directory, name)
+        tmp = "{}.{}.tmp".format(filename, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, filename)
+        with self.lock:
+            old = self.entries.get(name)
+            self.size += len(data) - (old[0] if old else 0)
+            self.entries[name] = [len(data), time.time()]
+            if self.size > self.maxbytes:
+                self._evict()
+
+    def _evict(self):
+        for name, (size, used) in sorted(self.entries.items(), key=lambda e: e[1][1]):
+            if self.size <= self.maxbytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            del self.entries[name]
+            self.size -= size
+
+    def discard(self, host, path):
+        name = self._filename(host, path)
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry:
+                self.size -= entry[0]
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+        Empties the cache
+        :return: None
+        """
+        with self.lock:
+            for name in self.entries:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            self.entries = {}
+            self.size = 0
+
+class CrawlCancelled(Exception):
+    """
+    Raised inside a crawl which has been abandoned - e.g. because it overran its time limit
+    """
+    pass
+
+class RedfishError(Exception):
+    """
+    Raised when a resource can't be got from a DRAC, once any retries have been used up
+    """
+    def __init__(self, host, path, message, status=None):
+        super().__init__("{}{}: {}".format(host, path, message))
+        self.host = host
+        self.path = path
+        self.status = status # HTTP status code, if the DRAC answered
+
+class CircuitOpen(RedfishError):
+    """
+    Raised, without trying, when a DRAC has failed so many times in a row that it's clearly down
+    """
+    pass
+
+def RetryAfter(value):
+    """
+    Parses a Retry-After header, which is either a number of seconds or an HTTP date
+    :return: seconds to wait, or None if there isn't a usable value
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Timings of the requests made to DRACs, which can be written out in the Prometheus text format at the end
+# of a run. Latency is per Redfish path, with member IDs replaced by {id} so that every CPU and NIC doesn't
+# get its own series; bytes and status codes are per host.
+Metrics = metrics.Registry()
+RedfishSeconds = Metrics.histogram('redfish_request_duration_seconds', 'Time taken by Redfish requests', ('path',))
+RedfishBytes = Metrics.counter('redfish_response_bytes_total', 'Bytes received from Redfish services', ('host',))
+RedfishResponses = Metrics.counter('redfish_responses_total', 'Redfish responses by status code', ('host', 'status'))
+
+def MetricPath(path):
+    """
+    Turns the path of a Redfish resource into the template it's counted under in the metrics, e.g.
+    /redfish/v1/Systems/System.Embedded.1/Processors/CPU.Socket.1 -> /redfish/v1/Systems/{id}/Processors/{id}.
+    Expanded collections are counted separately, as ...?$expand.
+    """
+    url = urllib.parse.urlsplit(path)
+    path = url.path
+    if path.startswith('/redfish/v1/'):
+        path = '/redfish/v1' + re.sub(r'/[^/]*[0-9.][^/]*', '/{id}', path[len('/redfish/v1'):])
+    return path + '?$expand' if '$expand' in urllib.parse.unquote(url.query) else path
 
 class DRAC:
     """
     An instance of a Dell iDRAC
     """
-    def __init__(self, host, user, password, port=443):
+    SessionsPath = '/redfish/v1/SessionService/Sessions'
+    RetryStatuses = (http.HTTPStatus.INTERNAL_SERVER_ERROR, http.HTTPStatus.BAD_GATEWAY,
+                     http.HTTPStatus.SERVICE_UNAVAILABLE, http.HTTPStatus.GATEWAY_TIMEOUT)
+
+    def __init__(self, host, user, password, port=443, concurrency=4, poolsize=None, usesession=True, expand=True,
+                 cache=None, refresh=False, keepjson=False, output=None, scheme='https', timeout=(5, 30), retries=3,
+                 retrybudget=20, backoff=0.5, maxbackoff=10, breakerthreshold=5, breakercooldown=30):
         """
         Dell iDRAC
+
+        `concurrency` caps the number of requests in flight to this DRAC at any one time, so that
+        a concurrent crawl doesn't overload the BMC.
+
+        Requests go over a single keep-alive HTTPS session holding up to `poolsize` connections
+        (defaults to `concurrency`). If `usesession` is set we log in to the Redfish SessionService
+        and use its X-Auth-Token rather than sending basic auth with every request.
+
+        If `expand` is set, and the DRAC advertises support for it, collections are fetched with
+        $expand (and $select where a subsystem asks for it) so that their members come back in the
+        same response rather than needing a GET each.
+
+        `cache` is an optional ResponseCache. Cached resources are fetched with If-None-Match and
+        served from the cache if the DRAC says they haven't changed. `refresh` ignores what's in the
+        cache (but still updates it).
+
+        `keepjson` keeps the raw JSON of each System as well as what's been extracted from it.
+
+        `output` is an optional JSONLWriter to which each resource is written as soon as it has been fetched.
+
+        `scheme` is only there so that we can talk to a fake DRAC over plain HTTP for testing.
+
+        Every request has a (connect, read) `timeout` in seconds. A request which fails to connect, times
+        out or gets a 500, 502, 503 or 504 is retried up to `retries` times, after a random wait of up to
+        `backoff` x 2^(attempt-1) seconds or, for a 503 with Retry-After, as long as the DRAC asks. No wait
+        is longer than `maxbackoff`; if the DRAC asks for longer, we give up. A crawl makes no more than
+        `retrybudget` retries in all. After `breakerthreshold` failures in a row the DRAC is taken to be
+        down and requests fail at once with CircuitOpen, apart from one every `breakercooldown` seconds
+        to see if it has come back. So a request to a dead DRAC takes at most about
+        (retries + 1) x (connect timeout + maxbackoff), and a crawl of one no more than `breakerthreshold`
+        times that. A request which can't be got raises RedfishError.
         """
 
         self.host = host
         self.user = user
         self.password = password
         self.port = port
-        self.baseurl = "https://{}:{}".format(host, port)
+        self.baseurl = "{}://{}:{}".format(scheme, host, port)
         self.version = None
         self.systems = {}
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.pool = None # Thread pool, only present whilst exploring
+        self.cancelled = False
+        self.errors = 0 # Parts of the DRAC which couldn't be crawled
+        self.wakeup = threading.Event() # Set on cancel, to cut short any wait before a retry
+        self.timeout = timeout
+        self.retries = retries
+        self.retrybudget = retrybudget
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.breakerthreshold = breakerthreshold
+        self.breakercooldown = breakercooldown
+        self.failures = 0 # In a row
+        self.openuntil = 0.0 # When the circuit breaker will next let a request through, if it's open
+        self.lock = threading.Lock()
+        self.expand = expand
+        self.features = {'expand': False, 'select': False} # What the DRAC supports. Set by explore()
+        self.cache = cache
+        self.refresh = refresh
+        self.keepjson = keepjson
+        self.output = output
+        self.poolsize = poolsize or concurrency
+        self.usesession = usesession
+        self.sessionurl = None # Location of our Redfish session, if we have one
+        self.session = requests.Session()
+        self.session.auth = (self.user, self.password)
+        self.session.verify = False
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.poolsize)
+        self.session.mount(self.baseurl, self.adapter)
 
     def __repr__(self):
         s =  "{}@{}:{}/{} {} systems detected:".format(self.user, self.host, self.port, Obscure(self.password), len(self.systems))
@@ -204,41 +554,837 @@ class DRAC:
 
     def get(self, path):
         """
-        Gets the specified relative URL and returns JS
-        :param path:
-        :return:
+        Gets the specified relative URL and returns its JSON, retrying as set up in __init__
+        :param path: relative URL
+        :return: dict
+        :raises RedfishError: if it can't be got (CircuitOpen if the DRAC is taken to be down)
+        :raises CrawlCancelled: if the crawl has been cancelled
         """
-        auth = (self.user, self.password)
         url = self.url(path)
         logging.debug("Getting {}".format(url))
+        cached = None
+        headers = {}
+        if self.cache is not None and not self.refresh:
+            cached = self.cache.get(self.host, path)
+            if cached:
+                headers['If-None-Match'] = cached['etag']
+        attempt = 0
+        while True:
+            if self.cancelled:
+                raise CrawlCancelled("Crawl of {} cancelled".format(self.host))
+            self._checkbreaker(path)
+            retryafter = None
+            try:
+                with self.slots:
+                    start = time.perf_counter() # Not counting the wait for a slot
+                    r = self.session.get(url, headers=headers, timeout=self.timeout)
+                    elapsed = time.perf_counter() - start
+            except requests.exceptions.RequestException as e:
+                RedfishResponses.inc(host=self.host, status='error')
+                error = RedfishError(self.host, path, e)
+            else:
+                RedfishSeconds.observe(elapsed, path=MetricPath(path))
+                RedfishBytes.inc(len(r.content), host=self.host)
+                RedfishResponses.inc(host=self.host, status=r.status_code)
+                if r.status_code == http.HTTPStatus.NOT_MODIFIED and cached:
+                    self._outcome(True)
+                    self.cache.record(True)
+                    return cached['body']
+                elif r.status_code == http.HTTPStatus.OK:
+                    self._outcome(True)
+                    try:
+                        body = r.json()
+                    except ValueError as e:
+                        raise RedfishError(self.host, path, "Bad JSON: {}".format(e), r.status_code)
+                    if self.cache is not None:
+                        self.cache.record(False)
+                        if r.headers.get('ETag'):
+                            self.cache.put(self.host, path, r.headers['ETag'], body)
+                    return body
+                error = RedfishError(self.host, path, "{} {}".format(r.status_code, r.reason), r.status_code)
+                if r.status_code not in DRAC.RetryStatuses:
+                    self._outcome(True) # The DRAC is up, it just doesn't like the request
+                    raise error
+                if r.status_code == http.HTTPStatus.SERVICE_UNAVAILABLE:
+                    retryafter = RetryAfter(r.headers.get('Retry-After'))
+            self._outcome(False)
+
+            attempt += 1
+            if retryafter is not None:
+                delay = retryafter
+            else:
+                delay = min(random.uniform(0, self.backoff * 2 ** (attempt - 1)), self.maxbackoff)
+            if attempt > self.retries or delay > self.maxbackoff or not self._spendretry():
+                raise error
+            logging.warning("Error getting {}. Retry {} of {} in {:.1f}s".format(error, attempt, self.retries, delay))
+            self.wakeup.wait(delay)
+
+    def _checkbreaker(self, path):
+        """
+        Raises CircuitOpen if the DRAC has failed too often in a row, unless it's time to try it again
+        """
+        with self.lock:
+            if self.failures >= self.breakerthreshold:
+                now = time.monotonic()
+                if now < self.openuntil:
+                    raise CircuitOpen(self.host, path, "{} failures in a row. Not trying again for {:.0f}s".format(
+                        self.failures, self.openuntil - now))
+                self.openuntil = now + self.breakercooldown # Let this one through, but no others for now
+
+    def _outcome(self, ok):
+        """
+        Records the outcome of a request for the circuit breaker
+        """
+        with self.lock:
+            if ok:
+                if self.failures >= self.breakerthreshold:
+                    logging.info("{} is answering again".format(self.host))
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.failures >= self.breakerthreshold:
+                    if self.failures == self.breakerthreshold:
+                        logging.warning("{} has failed {} times in a row. Taking it to be down".format(self.host, self.failures))
+                    self.openuntil = time.monotonic() + self.breakercooldown
+
+    def _spendretry(self):
+        """
+        Takes a retry from the crawl's budget
+        :return: False if there are none left
+        """
+        with self.lock:
+            if self.retrybudget <= 0:
+                return False
+            self.retrybudget -= 1
+            return True
+
+    def login(self):
+        """
+        Creates a Redfish session and switches to token authentication. Falls back to basic
+        auth if the DRAC won't give us a session.
+        :return: bool. True if we have a session
+        """
         try:
-            r = requests.get(url, auth=auth, verify=False)
-        except ConnectionError as e:
+            r = self.session.post(self.url(DRAC.SessionsPath), json={'UserName': self.user, 'Password': self.password},
+                                  timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
             logging.error("Error connecting to {}: {}".format(self.baseurl, e))
-        else:
-            if r.status_code == http.HTTPStatus.OK:
-                return r.json()
-            else:
-                logging.error("Error {} ({}) getting {}".format(r.status_code, http.HTTPStatus(r.status_code).name, url))
+            return False
+        token = r.headers.get('X-Auth-Token')
+        if r.status_code not in (http.HTTPStatus.OK, http.HTTPStatus.CREATED) or not token:
+            logging.warning("Can't create Redfish session on {} ({}). Using basic auth".format(self.host, r.status_code))
+            return False
+        self.session.headers['X-Auth-Token'] = token
+        self.session.auth = None
+        self.sessionurl = self.url(r.headers.get('Location', ''))
+        logging.debug("Created Redfish session {}".format(self.sessionurl))
+        return True
+
+    def logout(self):
+        """
+        Deletes our Redfish session, if we have one, and reverts to basic auth
+        :return: None
+        """
+        if self.sessionurl:
+            try:
+                self.session.delete(self.sessionurl, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                logging.warning("Error deleting Redfish session {}: {}".format(self.sessionurl, e))
+            self.sessionurl = None
+        self.session.headers.pop('X-Auth-Token', None)
+        self.session.auth = (self.user, self.password)
+
+    def cancel(self):
+        """
+        Abandons the crawl of this DRAC. Any further requests raise CrawlCancelled.
+        :return: None
+        """
+        self.cancelled = True
+        self.wakeup.set()
+
+    def close(self):
+        """
+        Logs out and closes the pooled connections to the DRAC
+        :return: None
+        """
+        self.logout()
+        self.session.close()
+
+    def connectionstats(self):
+        """
+        Returns the number of requests made and connections opened by the connection pool to the DRAC.
+        Every request over and above the number of connections is a TCP+TLS handshake saved. Only the pools
+        the adapter already has are read: asking the pool manager for the DRAC's pool would create a new one
+        (requests keys them by TLS settings too) and evict the one in use.
+        :return: dict
+        """
+        pools = self.adapter.poolmanager.pools
+        made = opened = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                made += pool.num_requests
+                opened += pool.num_connections
+        return {'requests': made, 'connections': opened, 'saved': made - opened}
+
+    def detectfeatures(self, rootjson):
+        """
+        Works out from the service root whether the DRAC supports $expand=.($levels=1) and $select
+        :param rootjson: JSON of /redfish/v1/
+        :return: dict
+        """
+        supported = rootjson.get('ProtocolFeaturesSupported') or {}
+        expand = supported.get('ExpandQuery') or {}
+        self.features = {'expand': bool(expand.get('NoLinks') and expand.get('Levels')),
+                         'select': bool(supported.get('SelectQuery'))}
+        logging.debug("{} supports {}".format(self.host, self.features))
+        return self.features
+
+    def expandquery(self, select=None):
+        """
+        Returns the query string to expand a collection's members inline, or an empty string if
+        the DRAC doesn't support it (or we've been told not to).
+        :param select: optional list of member properties to restrict the response to
+        :return: str
+        """
+        if not (self.expand and self.features['expand']):
+            return ''
+        if select and self.features['select']:
+            return '?$expand=.($levels=1;$select={})'.format(','.join(select))
+        return '?$expand=.($levels=1)'
+
+    def emit(self, system, kind, id, attributes):
+        """
+        Writes a resource found on the DRAC to the output, if there is one
+        :param system: name of the system the resource belongs to
+        :param kind: 'system', 'cpu', 'nic', 'storagecontroller' or 'disk'
+        :param id: the resource's name within the system
+        :param attributes: dict
+        :return: None
+        """
+        if self.output is not None:
+            self.output.write({'host': self.host, 'system': system, 'kind': kind, 'id': id, 'attributes': attributes})
+
+    def resources(self):
+        """
+        Yields everything found on the DRAC, as (system, kind, name, attributes) - the same records as are
+        written to the output
+        """
+        for sysname, system in self.systems.items():
+            yield sysname, 'system', sysname, {t: getattr(system, t) for t in system.tags}
+            for kind, subsystems in (('cpu', system.cpus), ('nic', system.nics), ('storagecontroller', system.storagecontrollers)):
+                for name, subsystem in subsystems.items():
+                    yield sysname, kind, name, subsystem.attributes()
+            for n, disk in enumerate(system.disks):
+                yield sysname, 'disk', str(n), disk.attributes()
+
+    def getmany(self, paths, tolerate=False):
+        """
+        Gets each of the specified relative URLs, concurrently if we are exploring, and returns
+        the JSON for each in the same order as `paths`
+        :param paths: iterable of relative URLs
+        :param tolerate: return the RedfishError for a URL which can't be got in place of its JSON, rather than raising it
+        :return: list
+        """
+        get = self._tryget if tolerate else self.get
+        paths = list(paths)
+        if self.pool is None or len(paths) < 2:
+            return [get(path) for path in paths]
+        return list(self.pool.map(get, paths))
+
+    def _tryget(self, path):
+        try:
+            return self.get(path)
+        except RedfishError as e:
+            return e
 
     def explore(self):
         """
         Go through the hierarchy of information on the DRAC
         :return: None
         """
+        if self.usesession and not self.sessionurl:
+            self.login()
+        before = self.connectionstats()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as self.pool:
+            try:
+                self._explore()
+            finally:
+                self.pool = None
+        after = self.connectionstats()
+        logging.info("Crawl of {} made {} requests over {} new connections ({} handshakes saved)".format(
+            self.host, after['requests'] - before['requests'], after['connections'] - before['connections'],
+            after['saved'] - before['saved']))
+
+    def _explore(self):
         chassisjson = self.get('/redfish/v1/')
         self.version = chassisjson.get('RedfishVersion')
+        self.detectfeatures(chassisjson)
 
         try:
             syspath = chassisjson['Systems']['@odata.id']
         except KeyError as e:
             logging.error("Error finding system URL")
         else:
-            sysjson = drac.get(syspath)
-            for system in sysjson['Members']:
-                sysurl = system['@odata.id']
+            sysjson = self.get(syspath)
+            sysurls = [system['@odata.id'] for system in sysjson['Members']]
+            for sysurl, systemjson in zip(sysurls, self.getmany(sysurls)):
                 sysname = os.path.split(sysurl)[1]
-                self.systems[sysname] = System(self, self.get(sysurl))
+                self.systems[sysname] = System(self, systemjson, sysname)
+
+class API:
+    """
+    The inventory API
+    """
+    def __init__(self, url, user, password):
+        self.baseurl = url
+        self.session = requests.Session()
+        self.session.auth = (user, password)
+
+    def url(self, path):
+        return urllib.parse.urljoin(self.baseurl, path)
+
+    def get(self, path):
+        """
+        Gets the specified relative URL and returns the JSON
+        :param path: str
+        :return: dict
+        """
+        r = self.session.get(self.url(path))
+        r.raise_for_status()
+        return r.json()
+
+    def servers(self):
+        """
+        Gets the list of servers known to the inventory
+        :return: list of dicts
+        """
+        return self.get('/inventory/api/v1/servers')['server']
+
+    def nics(self):
+        """
+        Gets the list of NICs known to the inventory
+        :return: list of dicts
+        """
+        return self.get('/inventory/api/v1/nics')['nic']
+
+    def post(self, path, data):
+        r = self.session.post(self.url(path), json=data)
+        r.raise_for_status()
+        return r.json()
+
+    def put(self, path, data):
+        r = self.session.put(self.url(path), json=data)
+        r.raise_for_status()
+        return r.json()
+
+    def delete(self, path):
+        r = self.session.delete(self.url(path))
+        r.raise_for_status()
+
+def NormaliseMAC(mac):
+    """
+    Returns a MAC address in the canonical upper-case, colon separated form - e.g. 08:00:2B:12:34:56
+    :param mac: str
+    :return: str or None if it doesn't look like a MAC
+    """
+    digits = ''.join(c for c in (mac or '') if c in string.hexdigits).upper()
+    if len(digits) != 12:
+        return None
+    return ':'.join(digits[i:i+2] for i in range(0, 12, 2))
+
+class Sync:
+    """
+    Brings the inventory API into line with what has been found on the DRACs, sending only the changes.
+    A crawled System is matched to an inventory server by service tag (the System's SKU) and its NICs
+    to inventory NICs by MAC address. A NIC's `sid` is the ID of the server it's in (not the server's SID).
+    """
+    def __init__(self, api, prune=True, dryrun=False):
+        """
+        :param api: API
+        :param prune: delete inventory NICs which are no longer present on their server
+        :param dryrun: work out and log the changes but don't make them
+        """
+        self.api = api
+        self.prune = prune
+        self.dryrun = dryrun
+        self.servers = {} # service tag -> server
+        self.nics = {} # MAC -> nic
+        self.counts = {'create': 0, 'update': 0, 'delete': 0, 'unchanged': 0, 'failed': 0}
+
+    def load(self):
+        """
+        Fetches what the inventory currently holds. One GET each for servers and NICs, however many
+        systems are then synced.
+        :return: None
+        """
+        self.servers = {s['tag'].upper(): s for s in self.api.servers() if s.get('tag')}
+        self.nics = {}
+        for nic in self.api.nics():
+            mac = NormaliseMAC(nic.get('mac'))
+            if mac:
+                self.nics[mac] = nic
+
+    def diff(self, system):
+        """
+        Works out what needs to change in the inventory for `system`
+        :param system: System
+        :return: dict of 'create', 'update' and 'delete' lists of (path, data), or None if the server isn't known
+        """
+        tag = getattr(system, 'SKU', None)
+        server = self.servers.get(tag.upper()) if tag else None
+        if server is None:
+            logging.warning("Service tag {} isn't in the inventory. Can't add NICs for it".format(tag))
+            return None
+        sid = int(os.path.basename(urllib.parse.urlparse(server['uri']).path)) # nics.sid holds the server's ID
+
+        found = {}
+        for name, nic in system.nics.items():
+            mac = NormaliseMAC(getattr(nic, 'PermanentMACAddress', None) or getattr(nic, 'MACAddress', None))
+            if mac:
+                found[mac] = name
+
+        changes = {'create': [], 'update': [], 'delete': []}
+        for mac, name in found.items():
+            nic = self.nics.get(mac)
+            if nic is None:
+                changes['create'].append(('/inventory/api/v1/nics', {'mac': mac, 'sid': sid, 'comment': name}))
+            elif nic['sid'] != sid: # Card has moved from another server
+                changes['update'].append((urllib.parse.urlparse(nic['uri']).path, {'sid': sid}))
+            else:
+                self.counts['unchanged'] += 1
+        if self.prune:
+            for mac, nic in self.nics.items():
+                if nic['sid'] == sid and mac not in found:
+                    changes['delete'].append((urllib.parse.urlparse(nic['uri']).path, None))
+        return changes
+
+    def apply(self, changes):
+        """
+        Sends the changes from diff() to the API, keeping our copy of the inventory up to date. A change which
+        the API refuses (e.g. 409 Conflict for a MAC it already has) is logged and counted as failed, and the
+        rest are still sent.
+        :return: None
+        """
+        for action, message in (('create', "Creating NIC {1}"), ('update', "Updating {0} with {1}"), ('delete', "Deleting {0}")):
+            for path, data in changes[action]:
+                logging.info(message.format(path, data))
+                if not self.dryrun:
+                    try:
+                        self._send(action, path, data)
+                    except requests.exceptions.HTTPError as e:
+                        logging.error("Couldn't {} {}: {}".format(action, data or path, e))
+                        self.counts['failed'] += 1
+                        continue
+                self.counts[action] += 1
+
+    def _send(self, action, path, data):
+        if action == 'create':
+            self.nics[data['mac']] = self.api.post(path, data)['nic']
+        elif action == 'update':
+            nic = self.api.put(path, data)['nic']
+            self.nics[NormaliseMAC(nic['mac'])] = nic
+        else:
+            self.api.delete(path)
+            self.nics = {m: n for m, n in self.nics.items() if urllib.parse.urlparse(n['uri']).path != path}
+
+    def sync(self, dracs):
+        """
+        Syncs every system found on `dracs` to the inventory
+        :param dracs: iterable of explored DRACs
+        :return: dict of counts of changes made
+        """
+        self.load()
+        for drac in dracs:
+            for system in drac.systems.values():
+                changes = self.diff(system)
+                if changes:
+                    self.apply(changes)
+        logging.info("Sync: {create} created, {update} updated, {delete} deleted, {unchanged} unchanged, {failed} failed".format(**self.counts))
+        return self.counts
+
+class Fleet:
+    """
+    Crawls a number of DRACs concurrently
+    """
+    def __init__(self, hosts, user, password, workers=32, timeout=300, retain=True, history=None, **kwargs):
+        """
+        :param hosts: list of DRAC host names/addresses
+        :param workers: maximum number of DRACs to crawl at any one time
+        :param timeout: seconds after which a crawl of a single DRAC is abandoned
+        :param retain: keep what was found on each DRAC. If the results are being streamed out instead,
+                       turning this off keeps memory use constant however big the fleet.
+        :param history: optional history.History in which to record what each successful crawl found
+        :param kwargs: passed through to each DRAC
+        """
+        self.hosts = list(dict.fromkeys(hosts)) # De-duplicated, but in order
+        self.user = user
+        self.password = password
+        self.workers = workers
+        self.timeout = timeout
+        self.retain = retain
+        self.history = history
+        self.dracargs = kwargs
+        self.results = {} # host -> {'status', 'duration', 'drac', 'error'}
+        self.elapsed = None
+
+    def __repr__(self):
+        return "\n\n".join(repr(r['drac']) for r in self.results.values() if r['status'] == 'ok')
+
+    def _crawl(self, drac, done):
+        """
+        Crawls a single DRAC. Runs in its own thread and posts (host, error) to `done` when finished.
+        """
+        error = None
+        try:
+            drac.explore()
+        except Exception as e:
+            error = e
+        finally:
+            try:
+                drac.close()
+            except Exception as e:
+                logging.debug("Error closing {}: {}".format(drac.host, e))
+        done.put((drac.host, error))
+
+    def crawl(self, progress=10):
+        """
+        Crawls every DRAC in the fleet, no more than `workers` at a time. A DRAC which takes longer than
+        `timeout` seconds is abandoned and its slot given to the next host, so one stuck BMC can't hold up
+        the rest of the fleet.
+        :param progress: seconds between progress reports
+        :return: dict of results by host
+        """
+        pending = list(reversed(self.hosts))
+        running = {} # host -> (drac, start time)
+        done = queue.Queue()
+        start = lastreport = time.monotonic()
+
+        while pending or running:
+            while pending and len(running) < self.workers:
+                self._start(pending.pop(), running, done)
+            now = self._collect(running, done)
+            if now - lastreport >= progress:
+                lastreport = now
+                logging.info("Fleet crawl: {}/{} done, {} running, {} pending, {:.1f} hosts/min".format(
+                    len(self.results), len(self.hosts), len(running), len(pending), self.throughput(now - start)))
+
+        self.elapsed = time.monotonic() - start
+        self.report()
+        return self.results
+
+    def _start(self, host, running, done):
+        """
+        Starts a crawl of `host` in its own thread, adding it to `running`
+        """
+        drac = DRAC(host, self.user, self.password, **self.dracargs)
+        running[host] = (drac, time.monotonic())
+        threading.Thread(target=self._crawl, args=(drac, done), name="crawl-{}".format(host), daemon=True).start()
+
+    def _collect(self, running, done, wait=0.5):
+        """
+        Waits up to `wait` seconds for a crawl to finish and records it, then abandons (and records) any crawl
+        which has overrun `timeout`
+        :param running: dict of host -> (drac, start time) of the crawls in progress
+        :param done: queue the crawl threads post (host, error) to
+        :return: the time (monotonic) it finished
+        """
+        try:
+            host, error = done.get(timeout=wait)
+        except queue.Empty:
+            pass
+        else:
+            if host in running: # Otherwise it has already been abandoned
+                drac, started = running.pop(host)
+                self._record(host, drac, started, 'error' if error else 'ok', error)
+
+        now = time.monotonic()
+        for host, (drac, started) in list(running.items()):
+            if now - started > self.timeout:
+                logging.warning("Abandoning crawl of {} after {:.0f}s".format(host, now - started))
+                drac.cancel()
+                del running[host]
+                self._record(host, drac, started, 'timeout', None)
+        return now
+
+    def _record(self, host, drac, started, status, error):
+        duration = time.monotonic() - started
+        if status == 'ok' and self.history is not None:
+            self.history.record(host, drac.resources(), complete=not drac.errors)
+        if not self.retain:
+            drac.systems = {}
+        self.results[host] = {'status': status, 'duration': duration, 'drac': drac, 'error': error}
+        if error:
+            logging.error("Crawl of {} failed after {:.1f}s: {}".format(host, duration, error))
+        else:
+            logging.debug("Crawl of {} {} in {:.1f}s".format(host, status, duration))
+
+    def throughput(self, elapsed=None):
+        """
+        Hosts crawled per minute
+        :return: float
+        """
+        elapsed = self.elapsed if elapsed is None else elapsed
+        return 60 * len(self.results) / elapsed if elapsed else 0.0
+
+    def stragglers(self, num=5):
+        """
+        Returns the hosts which timed out, followed by the slowest `num` of the rest
+        :return: list of (host, status, duration)
+        """
+        timedout = [(h, r['status'], r['duration']) for h, r in self.results.items() if r['status'] == 'timeout']
+        slowest = sorted(((h, r['status'], r['duration']) for h, r in self.results.items() if r['status'] != 'timeout'),
+                         key=lambda t: t[2], reverse=True)
+        return timedout + slowest[:num]
+
+    def report(self):
+        """
+        Logs a summary of the fleet crawl
+        :return: None
+        """
+        counts = {}
+        for r in self.results.values():
+            counts[r['status']] = counts.get(r['status'], 0) + 1
+        logging.info("Fleet crawl of {} hosts took {:.1f}s ({:.1f} hosts/min): {}".format(
+            len(self.hosts), self.elapsed, self.throughput(),
+            ", ".join("{} {}".format(v, k) for k, v in sorted(counts.items()))))
+        for host, status, duration in self.stragglers():
+            logging.info("Straggler: {:30} {:8} {:.1f}s".format(host, status, duration))
+        for (path,), (count, seconds) in sorted(RedfishSeconds.totals().items(), key=lambda t: t[1][1], reverse=True)[:5]:
+            logging.info("Time spent: {:60} {:6} requests {:8.1f}s ({:.0f}ms each)".format(
+                path, count, seconds, 1000 * seconds / count))
+
+class CrawlState:
+    """
+    What the scheduler knows about each host, kept in a JSON file so that it survives restarts: when it was
+    last tried, last crawled successfully and last seen to change, how long its last crawl took, how many
+    times in a row it has failed, a fingerprint of what was found on it and when it's next due.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.hosts = {} # host -> dict
+        self.lock = threading.Lock()
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename) as f:
+                    self.hosts = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning("Can't read crawl state from {}. Starting afresh: {}".format(filename, e))
+
+    def __repr__(self):
+        return "{}: {} hosts".format(self.filename, len(self.hosts))
+
+    def get(self, host):
+        """
+        Returns the state of `host`, creating it if it's new
+        :return: dict
+        """
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = {'lastattempt': None, 'lastsuccess': None, 'lastchange': None, 'duration': None,
+                                    'failures': 0, 'fingerprint': None, 'due': 0}
+            return self.hosts[host]
+
+    def save(self):
+        """
+        Writes the state to the file, replacing it atomically
+        :return: None
+        """
+        if not self.filename:
+            return
+        with self.lock:
+            data = json.dumps(self.hosts, indent=1, sort_keys=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.filename)
+
+class Scheduler(Fleet):
+    """
+    Crawls a fleet of DRACs continuously, rather than once. Each host is crawled every `interval` seconds,
+    or every `hotinterval` seconds if what was found on it has changed in the last `hotwindow` seconds.
+    A host which fails is retried with exponential backoff, up to `maxbackoff` seconds. Intervals are
+    stretched by up to `jitter` (a fraction) so that hosts don't stay in lockstep. Of the hosts which are
+    due, the ones which have gone longest without a successful crawl go first. No more than `rate` crawls
+    are started a minute, and no more than `workers` run at once.
+    """
+    def __init__(self, hosts, user, password, state=None, interval=3600, hotinterval=900, hotwindow=86400,
+                 maxbackoff=21600, jitter=0.1, rate=60, sync=None, syncinterval=300, **kwargs):
+        """
+        :param state: CrawlState
+        :param sync: function called with a list of the DRACs on which something has changed, every
+                     `syncinterval` seconds - e.g. to push the changes to the inventory
+        :param kwargs: passed through to Fleet
+        """
+        kwargs['retain'] = False
+        super().__init__(hosts, user, password, **kwargs)
+        self.state = state or CrawlState(None)
+        self.interval = interval
+        self.hotinterval = hotinterval
+        self.hotwindow = hotwindow
+        self.maxbackoff = maxbackoff
+        self.jitter = jitter
+        self.rate = rate
+        self.sync = sync
+        self.syncinterval = syncinterval
+        self.changed = [] # DRACs which have changed since the last sync
+        self.stopping = threading.Event()
+
+    def stop(self):
+        """
+        Asks run() to return once the crawls in progress have finished. Safe to call from a signal handler.
+        """
+        self.stopping.set()
+
+    @staticmethod
+    def fingerprint(drac):
+        """
+        A hash of everything found on `drac`, to tell whether anything has changed since the last crawl
+        :return: str
+        """
+        found = "\n\n".join("{}:\n{}".format(k, v) for k, v in sorted(drac.systems.items()))
+        return hashlib.sha1(found.encode()).hexdigest()
+
+    def due(self, now):
+        """
+        Returns the hosts which are due to be crawled, most out of date first
+        :return: list of str
+        """
+        due = [h for h in self.hosts if self.state.get(h)['due'] <= now]
+        return sorted(due, key=lambda h: self.state.get(h)['lastsuccess'] or 0)
+
+    def run(self, progress=60):
+        """
+        Crawls until stop() is called
+        :param progress: seconds between progress reports
+        :return: None
+        """
+        running = {} # host -> (drac, start time)
+        done = queue.Queue()
+        burst = max(1.0, float(min(self.workers, self.rate)))
+        tokens = burst
+        last = lastreport = lastsync = time.monotonic()
+
+        while not self.stopping.is_set() or running:
+            now = time.monotonic()
+            tokens = min(tokens + (now - last) * self.rate / 60, burst) # Rate budget, as a token bucket
+            last = now
+            if not self.stopping.is_set() and len(running) < self.workers and tokens >= 1:
+                for host in self.due(time.time()):
+                    if len(running) >= self.workers or tokens < 1:
+                        break
+                    if host in running:
+                        continue
+                    tokens -= 1
+                    self.state.get(host)['lastattempt'] = time.time()
+                    self._start(host, running, done)
+
+            now = self._collect(running, done)
+            if now - lastsync >= self.syncinterval:
+                lastsync = now
+                self.flush()
+            if now - lastreport >= progress:
+                lastreport = now
+                self.report()
+
+        self.flush()
+
+    def flush(self):
+        """
+        Passes the DRACs which have changed to the sync function and saves the state. If the sync fails they
+        are kept to be tried again at the next flush, and their fingerprints are forgotten so that, should we
+        be stopped before then, they're synced after their next crawl.
+        :return: None
+        """
+        changed = list({drac.host: drac for drac in self.changed}.values()) # The latest crawl of each host
+        self.changed = []
+        if changed and self.sync:
+            try:
+                self.sync(changed)
+            except Exception as e:
+                logging.error("Sync of {} changed hosts failed. Will try again: {}".format(len(changed), e))
+                for drac in changed:
+                    self.state.get(drac.host)['fingerprint'] = None
+                self.changed = changed + self.changed
+                changed = []
+        for drac in changed:
+            state = self.state.get(drac.host)
+            if state['fingerprint'] is None: # Forgotten after a failed sync, which has now gone through
+                state['fingerprint'] = self.fingerprint(drac)
+            drac.systems = {}
+        self.state.save()
+
+    def _record(self, host, drac, started, status, error):
+        """
+        Updates the host's state with the outcome of a crawl and works out when it's next due
+        """
+        now = time.time()
+        duration = time.monotonic() - started
+        state = self.state.get(host)
+        state['duration'] = round(duration, 3)
+        if status == 'ok':
+            if self.history is not None:
+                self.history.record(host, drac.resources(), complete=not drac.errors)
+            fingerprint = self.fingerprint(drac)
+            if fingerprint != state['fingerprint']:
+                if state['fingerprint'] is not None: # Not the first crawl, which isn't a change
+                    logging.info("Change found on {}".format(host))
+                    state['lastchange'] = now
+                state['fingerprint'] = fingerprint
+                if self.sync:
+                    self.changed.append(drac)
+            if drac not in self.changed:
+                drac.systems = {}
+            state['lastsuccess'] = now
+            state['failures'] = 0
+            hot = state['lastchange'] and now - state['lastchange'] < self.hotwindow
+            wait = self.hotinterval if hot else self.interval
+            logging.debug("Crawl of {} ok in {:.1f}s".format(host, duration))
+        else:
+            drac.systems = {}
+            state['failures'] += 1
+            wait = min(self.hotinterval * 2 ** (state['failures'] - 1), self.maxbackoff)
+            logging.error("Crawl of {} {} after {:.1f}s ({} in a row): {}".format(host, status, duration,
+                                                                                 state['failures'], error))
+        state['due'] = now + wait * (1 + random.uniform(0, self.jitter))
+        self.results[host] = {'status': status, 'duration': duration, 'drac': drac, 'error': error}
+
+    def report(self):
+        """
+        Logs how up to date the fleet is
+        :return: None
+        """
+        now = time.time()
+        ages = sorted(now - s['lastsuccess'] for s in (self.state.get(h) for h in self.hosts) if s['lastsuccess'])
+        failing = sum(1 for h in self.hosts if self.state.get(h)['failures'])
+        logging.info("Scheduler: {}/{} hosts crawled, {} failing, {} due, median age {:.0f}s, oldest {:.0f}s".format(
+            len(ages), len(self.hosts), failing, len(self.due(now)), ages[len(ages) // 2] if ages else 0,
+            ages[-1] if ages else 0))
+
+def FleetHosts(cp, hostfile=None, fromapi=False):
+    """
+    Builds the list of DRAC hosts for a fleet crawl from, in order, the `hosts` setting in the [FLEET]
+    section of the config, a file with one host per line, and the servers known to the inventory API.
+    The API doesn't know DRAC addresses, so for the latter the [FLEET] `hosttemplate` (e.g. idrac-{tag})
+    is filled in with each server's service tag.
+    :param cp: ConfigParser
+    :return: list of str
+    """
+    hosts = []
+    fleet = cp['FLEET'] if 'FLEET' in cp.sections() else {}
+    hosts.extend(fleet.get('hosts', '').replace(',', ' ').split())
+    hostfile = hostfile or fleet.get('hostfile')
+    if hostfile:
+        with open(hostfile) as f:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if line:
+                    hosts.append(line)
+    if fromapi:
+        api = API(cp['API']['url'], cp['API']['user'], cp['API']['password'])
+        template = fleet.get('hosttemplate', 'idrac-{tag}')
+        hosts.extend(template.format(**server) for server in api.servers())
+    return hosts
 
 def Obscure(text, num=1, symbol='*'):
     """
@@ -256,6 +1402,18 @@ if __name__ == '__main__':
     logging.captureWarnings(True)
     ap = argparse.ArgumentParser(description='Test the CLI', epilog="Copyright \N{COPYRIGHT SIGN} 2018 UKFast")
     ap.add_argument("--config", metavar='filename', help="Config file", default="apitest.cfg")
+    ap.add_argument("--hosts", metavar='filename', help="Crawl the fleet of DRACs listed in this file")
+    ap.add_argument("--fleet", action='store_true', help="Crawl the fleet of DRACs listed in the [FLEET] section")
+    ap.add_argument("--from-api", action='store_true', help="Crawl the DRACs of every server known to the API")
+    ap.add_argument("--daemon", action='store_true', help="Keep crawling the fleet, as set in the [SCHEDULER] section")
+    ap.add_argument("--refresh", action='store_true', help="Ignore the response cache and fetch everything afresh")
+    ap.add_argument("--sync", action='store_true', help="Push what has been found to the inventory API")
+    ap.add_argument("--dry-run", action='store_true', help="With --sync, only log the changes which would be made")
+    ap.add_argument("--jsonl", metavar='filename', help="Write each resource found as a JSON line to this file "
+                                                        "(- for stdout, .gz/.bz2/.xz to compress)")
+    ap.add_argument("--history", metavar='filename', help="Record what's found in this history database (see history.py)")
+    ap.add_argument("--metrics", metavar='filename', help="Write the timings of the requests made to the DRACs to "
+                                                          "this file in the Prometheus text format")
     args = ap.parse_args()
 
     cp = configparser.ConfigParser()
@@ -267,10 +1425,87 @@ if __name__ == '__main__':
         logging.critical("Can't open {} for reading!".format(args.config))
     else:
         if "DRAC" in cp.sections() and "API" in cp.sections():
-            if cp['DRAC']['user'] and cp['DRAC']['password'] and cp['DRAC']['host']:
-                drac = DRAC(cp['DRAC']['host'], cp['DRAC']['user'], cp['DRAC']['password'])
-                drac.explore()
-                print(drac)
+            dracargs = {'concurrency': cp['DRAC'].getint('concurrency', 4),
+                        'poolsize': cp['DRAC'].getint('poolsize', None),
+                        'usesession': cp['DRAC'].getboolean('usesession', True),
+                        'expand': cp['DRAC'].getboolean('expand', True),
+                        'timeout': (cp['DRAC'].getfloat('connecttimeout', 5), cp['DRAC'].getfloat('readtimeout', 30)),
+                        'retries': cp['DRAC'].getint('retries', 3),
+                        'retrybudget': cp['DRAC'].getint('retrybudget', 20),
+                        'backoff': cp['DRAC'].getfloat('backoff', 0.5),
+                        'maxbackoff': cp['DRAC'].getfloat('maxbackoff', 10),
+                        'breakerthreshold': cp['DRAC'].getint('breakerthreshold', 5),
+                        'breakercooldown': cp['DRAC'].getfloat('breakercooldown', 30),
+                        'refresh': args.refresh}
+            if args.jsonl:
+                dracargs['output'] = JSONLWriter(args.jsonl)
+            if 'CACHE' in cp.sections() and cp['CACHE'].get('directory'):
+                dracargs['cache'] = ResponseCache(cp['CACHE']['directory'], cp['CACHE'].getint('maxmb', 64)*1024*1024)
+            history = History(args.history) if args.history else None
+            if args.daemon:
+                hosts = FleetHosts(cp, args.hosts, args.from_api)
+                fleetcfg = cp['FLEET'] if 'FLEET' in cp.sections() else cp['DEFAULT']
+                schedcfg = cp['SCHEDULER'] if 'SCHEDULER' in cp.sections() else cp['DEFAULT']
+                sync = None
+                if args.sync:
+                    api = API(cp['API']['url'], cp['API']['user'], cp['API']['password'])
+                    sync = lambda changed: Sync(api, prune=cp['API'].getboolean('prune', True), dryrun=args.dry_run).sync(changed)
+                scheduler = Scheduler(hosts, cp['DRAC']['user'], cp['DRAC']['password'],
+                                      state=CrawlState(schedcfg.get('state', 'crawlstate.json')),
+                                      interval=schedcfg.getfloat('interval', 3600),
+                                      hotinterval=schedcfg.getfloat('hotinterval', 900),
+                                      hotwindow=schedcfg.getfloat('hotwindow', 86400),
+                                      maxbackoff=schedcfg.getfloat('maxbackoff', 21600),
+                                      jitter=schedcfg.getfloat('jitter', 0.1), rate=schedcfg.getfloat('rate', 60),
+                                      sync=sync, syncinterval=schedcfg.getfloat('syncinterval', 300),
+                                      workers=fleetcfg.getint('workers', 32), timeout=fleetcfg.getfloat('timeout', 300),
+                                      history=history, **dracargs)
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    signal.signal(signum, lambda signum, frame: scheduler.stop())
+                logging.info("Crawling {} hosts continuously. State in {}".format(len(scheduler.hosts), scheduler.state))
+                scheduler.run(progress=schedcfg.getfloat('progress', 60))
+                dracs = []
+            elif args.hosts or args.fleet or args.from_api:
+                hosts = FleetHosts(cp, args.hosts, args.from_api)
+                fleetcfg = cp['FLEET'] if 'FLEET' in cp.sections() else cp['DEFAULT']
+                fleet = Fleet(hosts, cp['DRAC']['user'], cp['DRAC']['password'],
+                              workers=fleetcfg.getint('workers', 32), timeout=fleetcfg.getfloat('timeout', 300),
+                              retain=args.sync or not args.jsonl, history=history, **dracargs)
+                fleet.crawl(progress=fleetcfg.getfloat('progress', 10))
+                if not args.jsonl:
+                    print(fleet)
+                dracs = [r['drac'] for r in fleet.results.values() if r['status'] == 'ok']
+            elif cp['DRAC']['user'] and cp['DRAC']['password'] and cp['DRAC']['host']:
+                drac = DRAC(cp['DRAC']['host'], cp['DRAC']['user'], cp['DRAC']['password'], **dracargs)
+                try:
+                    drac.explore()
+                    if not args.jsonl:
+                        print(drac)
+                    dracs = [drac]
+                    if history is not None:
+                        history.record(drac.host, drac.resources(), complete=not drac.errors)
+                except RedfishError as e:
+                    logging.critical("Crawl of {} failed: {}".format(drac.host, e))
+                    dracs = []
+                finally:
+                    drac.close()
+            else:
+                dracs = []
+            if args.sync and not args.daemon: # The scheduler syncs as it goes
+                api = API(cp['API']['url'], cp['API']['user'], cp['API']['password'])
+                try:
+                    Sync(api, prune=cp['API'].getboolean('prune', True), dryrun=args.dry_run).sync(dracs)
+                except requests.exceptions.RequestException as e:
+                    logging.critical("Sync to {} failed: {}".format(cp['API']['url'], e))
+            if 'cache' in dracargs:
+                logging.info("Response cache {}".format(dracargs['cache']))
+            if 'output' in dracargs:
+                dracargs['output'].close()
+            if args.metrics:
+                Metrics.write(args.metrics)
+            if history is not None:
+                logging.info("History {}".format(history))
+                history.close()
 
         else:
             logging.critical("Configuration file must have [DRAC] and [API] sections defined!")
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+A local history of what crawls have found, so that we can tell when a CPU, NIC, disk etc. changed without
+keeping a full copy of every crawl.
+
+It's an SQLite database. Each resource's attributes are stored once, compressed, under the hash of their
+content, so identical resources - on the same host from one crawl to the next or on different hosts - are
+only stored once. Each crawl of a host then only adds a row for each resource which has been added,
+changed or removed since the host's previous crawl: a chain of deltas per host. The state of a host at any
+time, and everything which changed across the fleet since a given time, come straight off the indexes
+rather than from replaying snapshots.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+Schema = """
+create table if not exists resources (
+    hash char(40) primary key,
+    data blob not null
+);
+create table if not exists crawls (
+    id integer primary key autoincrement,
+    host varchar(255) not null,
+    time double not null,
+    complete boolean not null,
+    added integer not null,
+    changed integer not null,
+    removed integer not null
+);
+create index if not exists ix_crawls_host_time on crawls (host, time);
+create table if not exists changes (
+    id integer primary key autoincrement,
+    host varchar(255) not null,
+    time double not null,
+    system varchar(255) not null,
+    kind varchar(40) not null,
+    name varchar(255) not null,
+    change varchar(10) not null,
+    hash char(40)
+);
+create index if not exists ix_changes_host_resource_time on changes (host, system, kind, name, time);
+create index if not exists ix_changes_time on changes (time);
+"""
+
+class History:
+    """
+    The history store
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.executescript(Schema)
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        stats = self.stats()
+        return "{}: {hosts} hosts, {crawls} crawls, {changes} changes, {resources} distinct resources in {bytes} bytes".format(
+            self.filename, **stats)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def _hash(attributes):
+        return hashlib.sha1(json.dumps(attributes, sort_keys=True).encode()).hexdigest()
+
+    def _load(self, hash):
+        row = self.db.execute("select data from resources where hash = ?", (hash,)).fetchone()
+        return json.loads(zlib.decompress(row[0]).decode())
+
+    def _current(self, host, when=None):
+        """
+        Returns {(system, kind, name): hash} of the resources present on `host` at `when` (default now)
+        """
+        # The latest change to each resource, the last recorded if several have the same time
+        rows = self.db.execute("select system, kind, name, change, hash from "
+                               "(select system, kind, name, change, hash, row_number() over "
+                               "(partition by system, kind, name order by time desc, id desc) as n "
+                               "from changes where host = ? and time <= ?) where n = 1",
+                               (host, when if when is not None else float('inf')))
+        return {(system, kind, name): hash for system, kind, name, change, hash in rows if change != 'removed'}
+
+    def record(self, host, resources, when=None, complete=True):
+        """
+        Records what a crawl of `host` found, storing only what has changed since the last crawl
+        :param resources: iterable of (system, kind, name, attributes), e.g. from DRAC.resources()
+        :param when: time of the crawl (default now)
+        :param complete: False if parts of the host couldn't be crawled, in which case resources which
+                         weren't found aren't taken to have been removed
+        :return: dict of counts of resources added, changed, removed and unchanged
+        """
+        when = time.time() if when is None else when
+        found = {}
+        blobs = {}
+        for system, kind, name, attributes in resources:
+            hash = History._hash(attributes)
+            found[(system, kind, name)] = hash
+            blobs[hash] = attributes
+        counts = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        with self.lock, self.db:
+            current = self._current(host)
+            changes = []
+            for key, hash in found.items():
+                if key not in current:
+                    changes.append(key + ('added', hash))
+                elif current[key] != hash:
+                    changes.append(key + ('changed', hash))
+                else:
+                    counts['unchanged'] += 1
+            if complete:
+                changes.extend(key + ('removed', None) for key in current if key not in found)
+            for change in changes:
+                counts[change[3]] += 1
+            new = {change[4] for change in changes if change[4]}
+            self.db.executemany("insert or ignore into resources (hash, data) values (?, ?)",
+                                [(hash, zlib.compress(json.dumps(blobs[hash], sort_keys=True).encode(), 9)) for hash in new])
+            self.db.executemany("insert into changes (host, time, system, kind, name, change, hash) values (?, ?, ?, ?, ?, ?, ?)",
+                                [(host, when) + change for change in changes])
+            self.db.execute("insert into crawls (host, time, complete, added, changed, removed) values (?, ?, ?, ?, ?, ?)",
+                            (host, when, complete, counts['added'], counts['changed'], counts['removed']))
+        if changes:
+            logging.info("History of {}: {added} added, {changed} changed, {removed} removed".format(host, **counts))
+        return counts
+
+    def state(self, host, when=None):
+        """
+        Returns what was on `host` as of its last crawl at or before `when` (default now)
+        :return: dict of (system, kind, name) -> attributes
+        """
+        with self.lock:
+            return {key: self._load(hash) for key, hash in self._current(host, when).items()}
+
+    def changes(self, since, until=None, host=None):
+        """
+        Returns everything which changed across the fleet (or on `host`) after `since` and up to `until`,
+        in time order
+        :return: list of dicts of host, time, system, kind, name, change ('added', 'changed' or 'removed')
+                 and attributes (the new ones, or None if removed)
+        """
+        query = "select host, time, system, kind, name, change, hash from changes where time > ? and time <= ?"
+        params = [since, until if until is not None else float('inf')]
+        if host is not None:
+            query += " and host = ?"
+            params.append(host)
+        with self.lock:
+            rows = self.db.execute(query + " order by time, id", params).fetchall()
+            return [{'host': h, 'time': t, 'system': s, 'kind': k, 'name': n, 'change': c,
+                     'attributes': self._load(hash) if hash else None} for h, t, s, k, n, c, hash in rows]
+
+    def crawls(self, host):
+        """
+        Returns the crawls recorded for `host`, oldest first
+        :return: list of dicts of time, complete, added, changed and removed
+        """
+        with self.lock:
+            rows = self.db.execute("select time, complete, added, changed, removed from crawls where host = ? order by time",
+                                   (host,)).fetchall()
+        return [{'time': t, 'complete': bool(c), 'added': a, 'changed': ch, 'removed': r} for t, c, a, ch, r in rows]
+
+    def stats(self):
+        """
+        Returns the numbers of hosts, crawls, changes and distinct resources held, and the compressed size
+        of the resources in bytes
+        :return: dict
+        """
+        with self.lock:
+            resources, size = self.db.execute("select count(*), coalesce(sum(length(data)), 0) from resources").fetchone()
+            hosts, crawls = self.db.execute("select count(distinct host), count(*) from crawls").fetchone()
+            changes, = self.db.execute("select count(*) from changes").fetchone()
+        return {'hosts': hosts, 'crawls': crawls, 'changes': changes, 'resources': resources, 'bytes': size}
+
+def ParseTime(value):
+    """
+    Parses a time given as Unix seconds or an ISO 8601 date/time (taken to be UTC if it has no zone)
+    :return: float
+    """
+    try:
+        return float(value)
+    except ValueError:
+        t = datetime.datetime.fromisoformat(value)
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=datetime.timezone.utc)
+        return t.timestamp()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)-8s: %(message)s")
+    ap = argparse.ArgumentParser(description='Query the history of what crawls have found')
+    ap.add_argument("--db", metavar='filename', default='history.db', help="History database")
+    sub = ap.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('state', help="What was on a host at a given time")
+    p.add_argument("host")
+    p.add_argument("--at", metavar='time', help="Unix seconds or ISO 8601 (default now)")
+    p = sub.add_parser('changes', help="What changed across the fleet since a given time")
+    p.add_argument("--since", metavar='time', required=True, help="Unix seconds or ISO 8601")
+    p.add_argument("--until", metavar='time', help="Unix seconds or ISO 8601 (default now)")
+    p.add_argument("--host")
+    sub.add_parser('stats', help="Size of the history")
+    args = ap.parse_args()
+
+    history = History(args.db)
+    if args.command == 'state':
+        for (system, kind, name), attributes in sorted(history.state(args.host, ParseTime(args.at) if args.at else None).items()):
+            print(json.dumps({'system': system, 'kind': kind, 'name': name, 'attributes': attributes}))
+    elif args.command == 'changes':
+        for change in history.changes(ParseTime(args.since), ParseTime(args.until) if args.until else None, args.host):
+            print(json.dumps(change))
+    else:
+        print(history)
+    history.close()
@@ -0,0 +1,295 @@
+"""
+Simple in-process metrics - counters and histograms with labels - which can be rendered in the Prometheus
+text exposition format. Used by the API server for its /metrics endpoint and by the client to export
+the timings of a crawl.
+
+A registry can be shared between processes, such as the API's gunicorn workers, through a directory: each
+process writes its values to a file of its own there every so often, and rendering sums the files, so that
+whichever process is scraped gives the totals for all of them.
+"""
+
+import bisect
+import glob
+import json
+import os
+import threading
+
+# Upper bounds, in seconds, of the latency histogram buckets. The last bucket (+Inf) is implicit.
+DefaultBuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _Escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _Labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _Escape(v)) for k, v in pairs) + '}'
+
+def _Number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of the metrics. Each holds one value per combination of label values.
+    """
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {} # tuple of label values -> value
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "{} {} ({} series)".format(self.type, self.name, len(self.values))
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("{} takes labels {}, not {}".format(self.name, self.labels, tuple(labels)))
+        return tuple(str(labels[l]) for l in self.labels)
+
+    def snapshot(self):
+        """
+        Returns the current values
+        :return: dict of tuple of label values -> value
+        """
+        with self.lock:
+            return dict(self.values)
+
+    def merge(self, a, b):
+        """
+        Adds up two values of the same series, e.g. from different processes
+        """
+        return a + b
+
+    def samples(self, values=None):
+        """
+        Yields (suffix, label values, extra labels, value) for each sample of `values` (default the current ones)
+        """
+        values = self.snapshot() if values is None else values
+        for key, value in sorted(values.items()):
+            yield '', key, (), value
+
+    def render(self, values=None):
+        """
+        Renders the metric in the Prometheus text format
+        :param values: values to render, as from snapshot(), rather than the current ones
+        :return: str
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.type)]
+        for suffix, key, extra, value in self.samples(values):
+            lines.append('{}{}{} {}'.format(self.name, suffix, _Labels(self.labels, key, extra), _Number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """
+    A count which only goes up, such as a number of requests or bytes
+    """
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """
+    Counts observations (usually durations in seconds) in buckets, along with their number and sum
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DefaultBuckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0] # bucket counts, count, sum
+            series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def totals(self):
+        """
+        Returns the number and sum of the observations for each combination of label values
+        :return: dict of label values -> (count, sum)
+        """
+        with self.lock:
+            return {key: (series[1], series[2]) for key, series in self.values.items()}
+
+    def snapshot(self):
+        with self.lock:
+            return {key: (list(series[0]), series[1], series[2]) for key, series in self.values.items()}
+
+    def merge(self, a, b):
+        return [x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]
+
+    def samples(self, values=None):
+        values = self.snapshot() if values is None else values
+        for key, (counts, count, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield '_bucket', key, (('le', _Number(bound)),), cumulative
+            yield '_count', key, (), count
+            yield '_sum', key, (), total
+
+
+class Callback(Metric):
+    """
+    A metric whose value is read when it's rendered, from something which keeps its own count (e.g. the
+    hits of a cache). `function` returns a number, or a dict of tuple of label values -> number.
+    """
+    def __init__(self, name, help, function, labels=(), type='gauge'):
+        super().__init__(name, help, labels)
+        self.function = function
+        self.type = type
+
+    def snapshot(self):
+        values = self.function()
+        return values if isinstance(values, dict) else {(): values}
+
+
+class Registry:
+    """
+    A set of metrics which are rendered together
+    """
+    def __init__(self):
+        self.metrics = []
+        self.directory = None # Shared with the other processes writing here, if set
+        self.filename = None
+        self.flushlock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def __repr__(self):
+        return "{} metrics{}".format(len(self.metrics), " shared in {}".format(self.directory) if self.directory else "")
+
+    def add(self, metric):
+        """
+        Adds `metric` to the registry
+        :return: metric
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DefaultBuckets):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, function, labels=(), type='gauge'):
+        return self.add(Callback(name, help, function, labels, type))
+
+    def share(self, directory, interval=1.0):
+        """
+        Shares the metrics with the other processes using `directory`. This process's values are written to
+        <pid>.json there now and every `interval` seconds, and render() sums the files. Files are left behind
+        when processes exit, so that counters never go backwards, but gauges only count while the process is
+        live (see Retire()). Call this in each process, after it has been forked.
+        :return: None
+        """
+        self.directory = directory
+        self.filename = os.path.join(directory, '{}.json'.format(os.getpid()))
+        self.stopped.clear()
+        self.flush()
+        threading.Thread(target=self._flusher, args=(interval,), name='metrics', daemon=True).start()
+
+    def _flusher(self, interval):
+        while not self.stopped.wait(interval):
+            self.flush()
+
+    def flush(self, live=True):
+        """
+        Writes this process's values to its file in the shared directory, replacing it atomically. After a
+        flush with live=False, as the process exits, its gauges no longer count and it isn't flushed again.
+        :return: None
+        """
+        if self.filename is None:
+            return
+        with self.flushlock:
+            if self.stopped.is_set():
+                return
+            state = {'live': live,
+                     'metrics': {m.name: [[list(key), value] for key, value in m.snapshot().items()] for m in self.metrics}}
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.filename)
+            if not live:
+                self.stopped.set()
+
+    def collect(self):
+        """
+        Sums the values written to the shared directory by all the processes using it
+        :return: dict of metric name -> dict of tuple of label values -> value
+        """
+        totals = {m.name: {} for m in self.metrics}
+        metrics = {m.name: m for m in self.metrics}
+        for filename in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(filename) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, values in state['metrics'].items():
+                m = metrics.get(name)
+                if m is None or (m.type == 'gauge' and not state['live']):
+                    continue
+                for key, value in values:
+                    key = tuple(key)
+                    totals[name][key] = m.merge(totals[name][key], value) if key in totals[name] else value
+        return totals
+
+    def render(self):
+        """
+        Renders all the metrics in the Prometheus text format, summed over all the processes if it's shared
+        :return: str
+        """
+        if self.directory is None:
+            return ''.join(m.render() for m in self.metrics)
+        self.flush()
+        totals = self.collect()
+        return ''.join(m.render(totals[m.name]) for m in self.metrics)
+
+    def write(self, filename):
+        """
+        Writes the rendered metrics to `filename`, replacing it atomically so that it can be picked up by
+        e.g. node_exporter's textfile collector
+        :return: None
+        """
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, filename)
+
+
+def Retire(directory, pid):
+    """
+    Marks the file of process `pid` in a shared directory as no longer live, so that its gauges stop counting,
+    for a process which exited without doing so (e.g. one which was killed)
+    :return: None
+    """
+    filename = os.path.join(directory, '{}.json'.format(pid))
+    try:
+        with open(filename) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return
+    if state['live']:
+        state['live'] = False
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(filename + '.tmp', filename)
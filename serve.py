@@ -0,0 +1,126 @@
+#!flask/bin/python
+
+"""
+Production entry point for the inventory API. Runs server.app under gunicorn, in a number of prefork worker
+processes each serving requests on a number of threads, rather than on the single-threaded development
+server which `python server.py` starts.
+
+Each worker imports the app and creates its DB engine after it has been forked, with a connection pool
+sized to its threads, so that no connections are shared between processes. On SIGTERM or SIGINT workers
+stop accepting connections and finish the requests they have in hand (for up to --graceful-timeout seconds)
+before closing their connections and exiting.
+
+The workers share their metrics through a directory (see metrics.Registry.share), so that /metrics gives the
+totals for the whole server whichever worker answers the scrape.
+"""
+
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import gunicorn.app.base
+
+import db
+import metrics
+
+
+class InventoryServer(gunicorn.app.base.BaseApplication):
+    """
+    gunicorn application serving server.app
+    """
+    def __init__(self, options, dburl=None, metricsdir=None, metricsinterval=1.0):
+        """
+        :param options: gunicorn settings (e.g. bind, workers, threads)
+        :param dburl: SQLAlchemy URL of the DB, if not db.DatabaseURL
+        :param metricsdir: directory through which the workers share their metrics. A temporary one, removed
+                           when the server stops, if not given.
+        :param metricsinterval: seconds between each worker writing its metrics there
+        """
+        self.options = options
+        self.dburl = dburl
+        self.metricsdir = metricsdir
+        self.temporary = metricsdir is None
+        self.metricsinterval = metricsinterval
+        super().__init__()
+
+    def load_config(self):
+        for k, v in self.options.items():
+            self.cfg.set(k, v)
+        self.cfg.set('on_starting', self.on_starting)
+        self.cfg.set('post_fork', self.post_fork)
+        self.cfg.set('worker_exit', self.worker_exit)
+        self.cfg.set('child_exit', self.child_exit)
+        self.cfg.set('on_exit', self.on_exit)
+
+    def load(self):
+        import server # In the worker, after fork, unless --preload
+        return server.app
+
+    def on_starting(self, arbiter):
+        """
+        Empties the metrics directory, so that the counters start from zero with the server
+        """
+        if self.temporary:
+            self.metricsdir = tempfile.mkdtemp(prefix='inventory-metrics-')
+        os.makedirs(self.metricsdir, exist_ok=True)
+        for filename in glob.glob(os.path.join(self.metricsdir, '*.json')):
+            os.remove(filename)
+
+    def post_fork(self, arbiter, worker):
+        """
+        Gives the new worker its own engine, with a pool of a connection per thread plus as many again for
+        overflow (streamed lists use a second connection)
+        """
+        threads = self.cfg.threads
+        db.Configure(self.dburl, pool_size=threads, max_overflow=threads)
+        import server
+        server.registry.share(self.metricsdir, self.metricsinterval)
+        logging.info("Worker {} started with {} threads".format(worker.pid, threads))
+
+    def worker_exit(self, arbiter, worker):
+        """
+        Closes the worker's DB connections once it has finished its requests, and writes its final metrics
+        """
+        db.Configure()
+        import server
+        server.registry.flush(live=False)
+        logging.info("Worker {} stopped".format(worker.pid))
+
+    def child_exit(self, arbiter, worker):
+        """
+        Stops counting the gauges of a worker which has gone, in case it was killed before it could say so
+        """
+        metrics.Retire(self.metricsdir, worker.pid)
+
+    def on_exit(self, arbiter):
+        if self.temporary:
+            shutil.rmtree(self.metricsdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s: %(levelname)-8s: %(message)s")
+    ap = argparse.ArgumentParser(description='Serve the inventory API')
+    ap.add_argument("--bind", default='127.0.0.1:5000', help="Address and port to listen on")
+    ap.add_argument("--workers", type=int, default=2 * multiprocessing.cpu_count() + 1, help="Worker processes")
+    ap.add_argument("--threads", type=int, default=4, help="Threads per worker")
+    ap.add_argument("--timeout", type=int, default=60, help="Seconds before a silent worker is killed and restarted")
+    ap.add_argument("--graceful-timeout", type=int, default=30,
+                    help="Seconds workers have to finish their requests when shutting down")
+    ap.add_argument("--max-requests", type=int, default=0, help="Restart workers after this many requests (0 for never)")
+    ap.add_argument("--preload", action='store_true', help="Import the app once, before forking the workers")
+    ap.add_argument("--access-log", metavar='filename', help="Access log file (- for stdout)")
+    ap.add_argument("--db", metavar='url', help="SQLAlchemy URL of the DB")
+    ap.add_argument("--metrics-dir", metavar='directory',
+                    help="Directory through which the workers share their metrics (default a temporary one)")
+    ap.add_argument("--metrics-interval", type=float, default=1.0, help="Seconds between workers saving their metrics")
+    args = ap.parse_args()
+
+    options = {'bind': args.bind, 'workers': args.workers, 'threads': args.threads, 'worker_class': 'gthread',
+               'timeout': args.timeout, 'graceful_timeout': args.graceful_timeout, 'max_requests': args.max_requests,
+               'max_requests_jitter': args.max_requests // 10, 'preload_app': args.preload, 'accesslog': args.access_log}
+    logging.info("Serving the inventory API on {} with {} workers of {} threads".format(args.bind, args.workers, args.threads))
+    InventoryServer(options, args.db, args.metrics_dir, args.metrics_interval).run()
@@ -3,34 +3,259 @@
 """Alternative version of the ToDo RESTful server implemented using the
 Flask-RESTful extension."""
 
-from flask import Flask, jsonify, abort, make_response, url_for
+from flask import Flask, jsonify, abort, make_response, url_for, request, Response, stream_with_context, g
 from flask_restful import Api, Resource, reqparse, fields, marshal
+from flask_restful.representations.json import output_json
 from flask_httpauth import HTTPBasicAuth
 import logging
 import hashlib
 import db
+import cache
+import metrics
 import http
+import json
+import functools
+import threading
+import time
+import urllib.parse
+
+try:
+    import orjson # Optional. See FAST_JSON.
+except ImportError:
+    orjson = None
 
 app = Flask(__name__, static_url_path="")
 api = Api(app)
 auth = HTTPBasicAuth()
+app.config.setdefault('AUTH_CACHE_SIZE', 1024)
+app.config.setdefault('AUTH_CACHE_TTL', 300)
+app.config.setdefault('AUTH_CACHE_CHECK', 1)
+app.config.setdefault('RESPONSE_CACHE_SIZE', 256)
+app.config.setdefault('RESPONSE_CACHE_TTL', 10)
+app.config.setdefault('RESPONSE_CACHE_MAX_BODY', 1024*1024)
+app.config.setdefault('FAST_JSON', False)
+
+def dumps(data):
+    """
+    Encodes `data` as JSON with orjson if FAST_JSON is set and it's installed, otherwise with json. orjson is
+    several times faster but leaves out the spaces after , and :, so the output isn't byte for byte the same.
+    """
+    if orjson is not None and app.config['FAST_JSON'] and not app.debug:
+        return orjson.dumps(data).decode()
+    return json.dumps(data)
+
+@api.representation('application/json')
+def output_fast_json(data, code, headers=None):
+    if orjson is not None and app.config['FAST_JSON'] and not app.debug:
+        response = make_response(orjson.dumps(data) + b'\n', code)
+        response.headers.extend(headers or {})
+        return response
+    return output_json(data, code, headers)
+
+caches = {} # Config prefix (e.g. AUTH_CACHE) -> cache.LRUCache
+caches_lock = threading.Lock()
+
+def configured_cache(prefix):
+    """
+    Returns the cache sized by app.config's <prefix>_SIZE and <prefix>_TTL, creating it the first time it's
+    needed, and again (keeping its hit and miss counts) if they've changed, so that they can be set at any time
+    :return: cache.LRUCache
+    """
+    size, ttl = app.config[prefix + '_SIZE'], app.config[prefix + '_TTL']
+    with caches_lock:
+        c = caches.get(prefix)
+        if c is None or (c.maxsize, c.ttl) != (size, ttl):
+            new = cache.LRUCache(size, ttl)
+            if c is not None:
+                new.hits, new.misses = c.hits, c.misses
+            c = caches[prefix] = new
+        return c
+
+def credentials():
+    """
+    Verified (user, password hash) pairs -> the version of the users table they were verified against, so that
+    most requests don't need a trip to the DB to authenticate
+    """
+    return configured_cache('AUTH_CACHE')
+
+users = {'version': None, 'next': 0.0} # Version of the users table when it was last checked, and when to check again
+users_lock = threading.Lock()
+
+def users_version():
+    """
+    Returns the version of the users table, reading it from the DB if AUTH_CACHE_CHECK seconds have passed
+    since it was last read. Credentials verified against an older version aren't trusted, so a password which
+    is changed or a user who is removed - through the API or not - stops working within that time.
+    :return: str
+    """
+    now = time.monotonic()
+    with users_lock:
+        if now < users['next']:
+            return users['version']
+        users['next'] = now + app.config['AUTH_CACHE_CHECK']
+    version = db.UsersVersion()
+    with users_lock:
+        if version != users['version']:
+            users['version'] = version
+            credentials().invalidate()
+    return version
+
+
+#---response cache------------------------------------------------------------------------------------
+
+def responses():
+    """
+    Rendered GET responses, keyed by (collection, id, path and query, the other collections an expanded response
+    includes). Writes through this process invalidate exactly the entries they affect; the TTL bounds how stale
+    an entry can be after a write made elsewhere.
+    """
+    return configured_cache('RESPONSE_CACHE')
+
+versions = {'servers': 0, 'nics': 0} # Bumped on every write, so a response computed across a write isn't cached
+versions_lock = threading.Lock()
+
+def invalidate(collection, id=None):
+    """
+    Drops the cached responses affected by a write to `collection`: the lists, and the item `id` if given,
+    otherwise every item.
+    """
+    with versions_lock:
+        versions[collection] += 1
+    responses().invalidate(lambda key: (key[0] == collection and (id is None or key[1] is None or key[1] == id))
+                                     or collection in key[3])
+
+def cached(collection, expands=()):
+    """
+    Decorator for GET methods of resources in `collection`. Serves the response from the cache if possible,
+    gives it a strong ETag, and answers If-None-Match with 304 Not Modified if the ETag still matches.
+    `expands` lists the other collections whose contents are included when the request has ?expand=...
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.args.get('stream'):
+                return f(*args, **kwargs)
+            depends = tuple(expands) if request.args.get('expand') else ()
+            key = (collection, kwargs.get('id'), request.full_path, depends)
+            entry = responses().get(key)
+            if entry is None:
+                version = [versions[c] for c in (collection,) + depends]
+                rv = f(*args, **kwargs)
+                response = api.make_response(*rv) if isinstance(rv, tuple) else api.make_response(rv, http.HTTPStatus.OK.value)
+                if response.status_code != http.HTTPStatus.OK:
+                    return response
+                body = response.get_data()
+                entry = (hashlib.sha1(body).hexdigest(), body, response.mimetype)
+                if len(body) <= app.config['RESPONSE_CACHE_MAX_BODY'] and [versions[c] for c in (collection,) + depends] == version:
+                    responses().put(key, entry)
+                cachestatus = 'MISS'
+            else:
+                cachestatus = 'HIT'
+            etag, body, mimetype = entry
+            if etag in request.if_none_match:
+                response = Response(status=http.HTTPStatus.NOT_MODIFIED.value)
+            else:
+                response = Response(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.headers['X-Cache'] = cachestatus
+            return response
+        return wrapper
+    return decorator
+
+
+#---metrics-------------------------------------------------------------------------------------------
+
+# Served in the Prometheus text format at /metrics. Requests are labelled with the URL rule they matched
+# rather than the path, so that each server or NIC doesn't get its own series.
+registry = metrics.Registry()
+request_seconds = registry.histogram('api_request_duration_seconds', 'Time taken to handle API requests',
+                                     ('method', 'route', 'status'))
+request_queries = registry.histogram('api_request_db_queries', 'SQL statements issued per API request',
+                                     ('method', 'route'), buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+request_db_seconds = registry.histogram('api_request_db_seconds', 'Time spent in the DB per API request',
+                                        ('method', 'route'))
+query_seconds = registry.histogram('db_query_duration_seconds', 'Time taken by SQL statements', ('statement',))
+registry.callback('api_cache_lookups_total', 'Lookups in the credential and response caches',
+                  lambda: {('auth', 'hit'): credentials().hits, ('auth', 'miss'): credentials().misses,
+                           ('response', 'hit'): responses().hits, ('response', 'miss'): responses().misses},
+                  labels=('cache', 'result'), type='counter')
+registry.callback('api_cache_entries', 'Entries in the credential and response caches',
+                  lambda: {('auth',): len(credentials()), ('response',): len(responses())}, labels=('cache',))
+
+@db.OnQuery
+def record_query(statement, seconds):
+    query_seconds.observe(seconds, statement=statement.split(None, 1)[0].upper() if statement.strip() else '')
+
+@app.before_request
+def reset_query_count():
+    g.start = time.perf_counter()
+    db.QueryCount(reset=True)
+
+@app.after_request
+def report_query_count(response):
+    """
+    Reports the number of SQL statements the request took in the X-Query-Count header, and records the
+    request in the metrics. The time of a streamed response only covers starting the stream.
+    """
+    count = db.QueryCount()
+    logging.debug("{} {} took {} queries".format(request.method, request.path, count))
+    response.headers['X-Query-Count'] = str(count)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_seconds.observe(time.perf_counter() - g.start, method=request.method, route=route,
+                            status=response.status_code)
+    request_queries.observe(count, method=request.method, route=route)
+    request_db_seconds.observe(db.QueryTime(), method=request.method, route=route)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+#---health--------------------------------------------------------------------------------------------
+
+@app.route('/health')
+def health():
+    """
+    Liveness: the process is up and serving requests
+    """
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready')
+def ready():
+    """
+    Readiness: the DB can be reached, so requests can be served. 503 if not.
+    """
+    if db.Ping():
+        return jsonify({'status': 'ready'})
+    return make_response(jsonify({'status': 'unavailable'}), http.HTTPStatus.SERVICE_UNAVAILABLE.value)
+
+@app.teardown_appcontext
+def remove_session(exception=None):
+    db.Session.remove()
 
 
 @auth.verify_password
 def verify_password(user, password):
     """
     Verifies a user/password combintation by SHA2-512 hashing the supplied password and comparing
-    against the value stored in the backend DB.
+    against the value stored in the backend DB. Combinations which have been verified recently are
+    remembered, so the DB is only consulted for new ones, once AUTH_CACHE_TTL seconds have passed, or
+    when the users table has changed (which is checked every AUTH_CACHE_CHECK seconds).
     :param user: user name (e.g. tim)
     :param password: password (e.g. swordfish123)
     :return: True if matches, else False
     """
-    logging.debug("verify_password passed user='{}' ; password='{}'".format(user, password))
+    logging.debug("verify_password passed user='{}'".format(user))
+    newhash = hashlib.sha512()
+    newhash.update(password.encode())
+    digest = newhash.hexdigest().upper()
+    version = users_version()
+    if credentials().get((user, digest)) == version:
+        return True
     dbhash = db.GetHashedPassword(user)
-    if dbhash:
-        newhash = hashlib.sha512()
-        newhash.update(password.encode())
-        return newhash.hexdigest().upper() == dbhash.upper()
+    if dbhash and digest == dbhash.upper():
+        credentials().put((user, digest), version)
+        return True
     return False
 
 
@@ -41,6 +266,131 @@ def unauthorized():
     # auth dialog
     return make_response(jsonify({'message': 'Unauthorized access'}), http.HTTPStatus.FORBIDDEN.value)
 
+#---lists---------------------------------------------------------------------------------------------
+
+MaxPageSize = 1000
+
+list_parser = reqparse.RequestParser()
+list_parser.add_argument('after',  type=int, location='args')
+list_parser.add_argument('limit',  type=int, location='args')
+list_parser.add_argument('stream', type=str, choices=('json', 'ndjson'), location='args')
+list_parser.add_argument('tag',    type=str, location='args')
+list_parser.add_argument('sid',    type=int, location='args')
+list_parser.add_argument('mac',    type=str, location='args')
+list_parser.add_argument('ip',     type=str, location='args')
+
+def ValidMAC(mac):
+    """
+    True if `mac` is a MAC address or, if it ends with *, the start of one
+    """
+    try:
+        db.MACPrefixRange(mac[:-1]) if mac.endswith('*') else db.MACToInt(mac)
+    except ValueError:
+        return False
+    return True
+
+class RowEncoder:
+    """
+    A fast equivalent of marshal(row, fields) for the rows of a list. The fields are compiled, once, into a
+    function which builds the output dict directly, and each Url field is resolved by url_for once per
+    request to a prefix and suffix around the row's ID rather than once per row. The output is the same,
+    so the JSON is byte for byte the same. Rows must be dicts. Fields other than plain String, Integer and
+    relative Url fields whose endpoint takes just an id are left to the field's own output method.
+    """
+    Sentinel = 987654321 # Stands in for the ID when building URL templates
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.encode = None
+        self.endpoints = [] # Of the Url fields turned into templates, in the order encode expects them
+
+    def compile(self):
+        """
+        Generates the encoding function. Done on first use, as it needs the Url fields' endpoints to exist.
+        """
+        namespace = {'str': str, 'int': int}
+        lines = ['def encode(row, urls):', '    get = row.get']
+        items = []
+        for n, (name, field) in enumerate(self.spec.items()):
+            field = field() if isinstance(field, type) else field
+            key = name if field.attribute is None else field.attribute
+            namespace['default{}'.format(n)] = field.default
+            namespace['field{}'.format(n)] = field
+            if type(field) in (fields.String, fields.Integer) and isinstance(key, str) and '.' not in key:
+                convert = 'str' if type(field) is fields.String else 'int'
+                lines.append('    v = get({!r})'.format(key))
+                lines.append('    f{0} = default{0} if v is None else {1}(v)'.format(n, convert))
+            elif type(field) is fields.Url and not field.absolute and \
+                    all(rule.arguments == {'id'} for rule in app.url_map.iter_rules(field.endpoint)):
+                lines.append('    f{} = urls[{}][0] + str(row["id"]) + urls[{}][1]'.format(n, len(self.endpoints), len(self.endpoints)))
+                self.endpoints.append(field.endpoint)
+            else:
+                lines.append('    f{0} = field{0}.output({1!r}, row)'.format(n, name))
+            items.append('{!r}: f{}'.format(name, n))
+        lines.append('    return {{{}}}'.format(', '.join(items)))
+        exec('\n'.join(lines), namespace)
+        self.encode = namespace['encode']
+
+    def bind(self):
+        """
+        Returns a function which encodes a row, with the URL templates resolved for the current request
+        :return: callable
+        """
+        if self.encode is None:
+            self.compile()
+        urls = []
+        for endpoint in self.endpoints:
+            path = urllib.parse.urlparse(url_for(endpoint, id=RowEncoder.Sentinel)).path
+            prefix, _, suffix = path.partition(str(RowEncoder.Sentinel))
+            urls.append((prefix, suffix))
+        return functools.partial(self.encode, urls=tuple(urls))
+
+def ListResponse(key, encoder, endpoint, get, iterate, filters=()):
+    """
+    Builds the response for a list endpoint. By default the whole list is returned. With `after` and/or
+    `limit` a page of at most `limit` rows with IDs after `after` is returned, with a `next` link to
+    the following page if there may be one. With `stream` the rows are streamed from the DB, a batch
+    at a time, as a chunked JSON document (`json`) or one JSON object per line (`ndjson`).
+    Any of the `filters` given in the query string are passed on to the DB, so as to use its indexes.
+    :param key: name of the list in the JSON (e.g. 'server')
+    :param encoder: RowEncoder for the rows
+    :param endpoint: endpoint of the list, for the next link
+    :param get: db function returning a list of rows, taking after and limit
+    :param iterate: db function yielding rows, taking after
+    :param filters: names of the query string arguments the db functions accept as filters
+    """
+    args = list_parser.parse_args()
+    criteria = {f: args[f] for f in filters if args[f] is not None}
+    if criteria.get('mac') and not ValidMAC(criteria['mac']):
+        abort(http.HTTPStatus.BAD_REQUEST.value)
+    encode = encoder.bind()
+    if args['stream']:
+        def generate():
+            if args['stream'] == 'ndjson':
+                for row in iterate(after=args['after'], **criteria):
+                    yield dumps(encode(row)) + '\n'
+            else:
+                yield '{{"{}": ['.format(key)
+                separator = ''
+                for row in iterate(after=args['after'], **criteria):
+                    yield separator + dumps(encode(row))
+                    separator = ','
+                yield ']}'
+        mimetype = 'application/x-ndjson' if args['stream'] == 'ndjson' else 'application/json'
+        return Response(stream_with_context(generate()), mimetype=mimetype)
+
+    if args['after'] is None and args['limit'] is None:
+        return {key: [encode(row) for row in get(**criteria)]}
+
+    limit = MaxPageSize if args['limit'] is None else min(args['limit'], MaxPageSize)
+    if limit < 1:
+        abort(http.HTTPStatus.BAD_REQUEST.value)
+    rows = get(after=args['after'], limit=limit, **criteria)
+    rv = {key: [encode(row) for row in rows]}
+    if len(rows) == limit:
+        rv['next'] = url_for(endpoint, after=rows[-1]['id'], limit=limit, **criteria)
+    return rv
+
 #---servers-------------------------------------------------------------------------------------------
 
 server_fields = {
@@ -50,6 +400,7 @@ server_fields = {
     'comment': fields.String,
     'uri':     fields.Url('server')
 }
+server_encoder = RowEncoder(server_fields)
 
 class ServerListAPI(Resource):
     #decorators = [auth.login_required]
@@ -62,9 +413,10 @@ class ServerListAPI(Resource):
         self.reqparse.add_argument('comment',type=str, location='json')
         super(ServerListAPI, self).__init__()
 
+    @cached('servers')
     def get(self):
         logging.debug("Getting server list...")
-        return {'server': [marshal(server, server_fields) for server in db.GetServers()]}
+        return ListResponse('server', server_encoder, 'servers', db.GetServers, db.IterServers, filters=('tag', 'sid'))
 
     def post(self):
         args = self.reqparse.parse_args()
@@ -77,6 +429,7 @@ class ServerListAPI(Resource):
         updated = db.CreateServer(server)
         logging.debug("Got {}".format(updated))
         if 'id' in updated:
+            invalidate('servers', updated['id'])
             return {'server': marshal(updated, server_fields)}, http.HTTPStatus.CREATED.value
         else:
             abort(http.HTTPStatus.CONFLICT.value)
@@ -92,15 +445,29 @@ class ServerAPI(Resource):
         self.reqparse.add_argument('comment',type=str, location='json')
         super(ServerAPI, self).__init__()
 
+    @cached('servers', expands=['nics'])
     def get(self, id):
-        server = db.GetServer(id)
+        """
+        Gets a server. With ?expand=nics its NICs are included, and with ?expand=nics.ips so are their
+        IP addresses, all from a single DB query.
+        """
+        expand = request.args.get('expand')
+        if expand:
+            if expand not in ('nics', 'nics.ips'):
+                abort(http.HTTPStatus.BAD_REQUEST.value)
+            server = db.GetServerTree(id, ips=(expand == 'nics.ips'))
+            spec = server_tree_fields if expand == 'nics.ips' else server_nics_fields
+        else:
+            server = db.GetServer(id)
+            spec = server_fields
         if server:
-            return {'server': marshal(server, server_fields)}
+            return {'server': marshal(server, spec)}
         else:
             abort(404)
 
     def delete(self, id):
         if db.DeleteServer(id):
+            invalidate('servers', id)
             return '', http.HTTPStatus.OK.value
         else:
             abort(http.HTTPStatus.NOT_FOUND.value)
@@ -114,9 +481,29 @@ class ServerAPI(Resource):
             if k not in ['tag', 'id'] and v:
                 server[k] = v
         db.UpdateServer(id, server)
+        invalidate('servers', id)
         return {'server': marshal(server, server_fields)}
 
 
+class ServerBulkAPI(Resource):
+    decorators = [auth.login_required]
+
+    def post(self):
+        """
+        Creates or updates (matching on service tag) each server in a JSON array, in a single transaction.
+        Returns a result per item, reporting conflicts rather than failing the whole batch.
+        """
+        servers = request.get_json(silent=True)
+        if not isinstance(servers, list) or not all(isinstance(s, dict) for s in servers):
+            abort(http.HTTPStatus.BAD_REQUEST.value)
+        results = db.UpsertServers(servers)
+        invalidate('servers')
+        for r in results:
+            if r.get('id') is not None:
+                r['uri'] = url_for('server', id=r['id'])
+        return {'server': results}, http.HTTPStatus.OK.value
+
+
 #---nics----------------------------------------------------------------------------------------------
 
 nic_fields = {
@@ -125,6 +512,7 @@ nic_fields = {
     'comment': fields.String,
     'uri':     fields.Url('nic')
 }
+nic_encoder = RowEncoder(nic_fields)
 
 class NICListAPI(Resource):
     decorators = [auth.login_required]
@@ -136,12 +524,15 @@ class NICListAPI(Resource):
         self.reqparse.add_argument('comment',type=str, location='json')
         super(NICListAPI, self).__init__()
 
+    @cached('nics')
     def get(self):
         logging.debug("Getting nic list...")
-        return {'nic': [marshal(nic, nic_fields) for nic in db.GetNICs()]}
+        return ListResponse('nic', nic_encoder, 'nics', db.GetNICs, db.IterNICs, filters=('mac', 'sid', 'tag', 'ip'))
 
     def post(self):
         args = self.reqparse.parse_args()
+        if not ValidMAC(args['mac']) or args['mac'].endswith('*'):
+            abort(http.HTTPStatus.BAD_REQUEST.value)
         nic = {
             'mac': args['mac'],
             'sid': args['sid'],
@@ -150,6 +541,7 @@ class NICListAPI(Resource):
         updated = db.CreateNIC(nic)
         logging.debug("Got {}".format(updated))
         if 'id' in updated:
+            invalidate('nics', updated['id'])
             return {'nic': marshal(updated, nic_fields)}, http.HTTPStatus.CREATED.value
         else:
             abort(http.HTTPStatus.CONFLICT.value)
@@ -164,6 +556,7 @@ class NICAPI(Resource):
         self.reqparse.add_argument('comment',type=str, location='json')
         super(NICAPI, self).__init__()
 
+    @cached('nics')
     def get(self, id):
         nic = db.GetNIC(id)
         if nic:
@@ -173,6 +566,7 @@ class NICAPI(Resource):
 
     def delete(self, id):
         if db.DeleteNIC(id):
+            invalidate('nics', id)
             return '', http.HTTPStatus.OK.value
         else:
             abort(http.HTTPStatus.NOT_FOUND.value)
@@ -182,17 +576,113 @@ class NICAPI(Resource):
         if not nic:
             abort(http.HTTPStatus.NOT_FOUND.value)
         args = self.reqparse.parse_args()
+        if args['mac'] and (not ValidMAC(args['mac']) or args['mac'].endswith('*')):
+            abort(http.HTTPStatus.BAD_REQUEST.value)
         for k, v in args.items():
             if k not in ['id'] and v:
                 nic[k] = v
         db.UpdateNIC(id, nic)
+        invalidate('nics', id)
         return {'nic': marshal(nic, nic_fields)}
 
 
+class NICBulkAPI(Resource):
+    decorators = [auth.login_required]
+
+    def post(self):
+        """
+        Creates or updates (matching on MAC address) each NIC in a JSON array, in a single transaction.
+        Returns a result per item, reporting conflicts rather than failing the whole batch.
+        """
+        nics = request.get_json(silent=True)
+        if not isinstance(nics, list) or not all(isinstance(n, dict) for n in nics):
+            abort(http.HTTPStatus.BAD_REQUEST.value)
+        results = db.UpsertNICs(nics)
+        invalidate('nics')
+        for r in results:
+            if r.get('id') is not None:
+                r['uri'] = url_for('nic', id=r['id'])
+        return {'nic': results}, http.HTTPStatus.OK.value
+
+
+ip_fields = {
+    'id': fields.Integer,
+    'ip': fields.String
+}
+
+server_nics_fields = dict(server_fields, nics=fields.List(fields.Nested(nic_fields)))
+server_tree_fields = dict(server_fields, nics=fields.List(fields.Nested(dict(nic_fields, ips=fields.List(fields.Nested(ip_fields))))))
+
+#---changes-------------------------------------------------------------------------------------------
+
+MaxChangeWait = 30 # Seconds a request for changes can wait for one
+ChangePollInterval = 1.0 # Seconds between checks of the DB for changes made by other processes
+
+change_parser = reqparse.RequestParser()
+change_parser.add_argument('since', type=int, location='args')
+change_parser.add_argument('limit', type=int, location='args')
+change_parser.add_argument('wait',  type=float, location='args')
+
+# Writes through this process wake waiting requests at once; other processes' are seen on the next poll
+change_writes = 0
+change_condition = threading.Condition()
+
+@db.OnChange
+def wake_change_watchers(collection):
+    global change_writes
+    with change_condition:
+        change_writes += 1
+        change_condition.notify_all()
+
+class ChangesAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self):
+        """
+        Gets the changes to servers and NICs after version ?since=, oldest first, each with the server or NIC
+        as it is now (null if it's since been deleted), and the version to pass as since= next time. With
+        ?wait=<seconds> the request waits (up to MaxChangeWait) for a change if there aren't any yet.
+        Without since= just the current version is returned, to follow from. 410 if since= is after the
+        current version, as the change log has been reset and the caller needs to start again.
+        """
+        args = change_parser.parse_args()
+        limit = MaxPageSize if args['limit'] is None else min(args['limit'], MaxPageSize)
+        wait = min(max(args['wait'] or 0, 0), MaxChangeWait)
+        if limit < 1 or (args['since'] is not None and args['since'] < 0):
+            abort(http.HTTPStatus.BAD_REQUEST.value)
+        if args['since'] is None:
+            return {'change': [], 'version': db.LatestVersion()}
+        deadline = time.monotonic() + wait
+        while True:
+            with change_condition:
+                writes = change_writes
+            changes, version = db.GetChanges(args['since'], limit)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                break
+            db.Session.remove() # End the transaction, so the next check sees new commits, and free the connection
+            with change_condition:
+                change_condition.wait_for(lambda: change_writes != writes, min(remaining, ChangePollInterval))
+        if not changes and args['since'] > db.LatestVersion():
+            abort(http.HTTPStatus.GONE.value)
+        encoders = {'servers': ('server', server_encoder.bind()), 'nics': ('nic', nic_encoder.bind())}
+        for change in changes:
+            key, encode = encoders[change['collection']]
+            record = change.pop('record')
+            change[key] = encode(record) if record else None
+        rv = {'change': changes, 'version': version}
+        if len(changes) == limit:
+            rv['next'] = url_for('changes', since=version, limit=limit)
+        return rv
+
+
 api.add_resource(ServerListAPI, '/inventory/api/v1/servers', endpoint='servers')
 api.add_resource(ServerAPI, '/inventory/api/v1/server/<int:id>', endpoint='server')
 api.add_resource(NICListAPI, '/inventory/api/v1/nics', endpoint='nics')
 api.add_resource(NICAPI, '/inventory/api/v1/nic/<int:id>', endpoint='nic')
+api.add_resource(ServerBulkAPI, '/inventory/api/v1/servers:bulk', endpoint='servers_bulk')
+api.add_resource(NICBulkAPI, '/inventory/api/v1/nics:bulk', endpoint='nics_bulk')
+api.add_resource(ChangesAPI, '/inventory/api/v1/changes', endpoint='changes')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,42 @@
+"""
+Shared fixtures. The tests run against a throwaway SQLite database, so they don't need MySQL.
+"""
+
+import base64
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    An empty inventory DB with one user, tim/swordfish123
+    """
+    db.Configure('sqlite:///{}'.format(tmp_path / 'inventory.db'))
+    db.CreateSchema()
+    session = db.Session()
+    session.add(db.User(name='tim', hash=hashlib.sha512(b'swordfish123').hexdigest().upper()))
+    session.commit()
+    yield
+    db.Session.remove()
+    db.Configure()
+
+@pytest.fixture
+def api(database):
+    """
+    A test client for the API, with empty credential and response caches
+    """
+    import server
+    server.caches.clear()
+    server.users.update(version=None, next=0.0)
+    return server.app.test_client()
+
+@pytest.fixture
+def auth():
+    return {'Authorization': 'Basic ' + base64.b64encode(b'tim:swordfish123').decode()}
@@ -0,0 +1,61 @@
+"""
+Tests of authentication and the credential cache
+"""
+
+import base64
+import hashlib
+
+import pytest
+
+import db
+import server
+
+NICs = '/inventory/api/v1/nics' # The server list doesn't need authentication
+
+
+def Auth(user, password):
+    return {'Authorization': 'Basic ' + base64.b64encode('{}:{}'.format(user, password).encode()).decode()}
+
+def SetPassword(user, password):
+    """
+    Changes a password behind the API's back, as an admin tool would
+    """
+    with db.GetEngine().begin() as conn:
+        conn.execute(db.User.__table__.update().where(db.User.name == user),
+                     {'hash': hashlib.sha512(password.encode()).hexdigest().upper()})
+
+@pytest.fixture
+def check(monkeypatch):
+    monkeypatch.setitem(server.app.config, 'AUTH_CACHE_CHECK', 0) # Check the users table on every request
+
+
+def test_cached_credentials_skip_the_db(api, auth, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'AUTH_CACHE_CHECK', 3600)
+    assert api.get(NICs, headers=auth).status_code == 200
+    assert api.get(NICs + '?sid=1', headers=auth).headers['X-Query-Count'] == '1' # Only the list
+    assert server.credentials().hits == 1
+
+def test_password_change(api, check):
+    assert api.get(NICs, headers=Auth('tim', 'swordfish123')).status_code == 200
+    SetPassword('tim', 'marlin456')
+    assert api.get(NICs, headers=Auth('tim', 'swordfish123')).status_code == 403
+    assert api.get(NICs, headers=Auth('tim', 'marlin456')).status_code == 200
+
+def test_revocation(api, auth, check):
+    assert api.get(NICs, headers=auth).status_code == 200
+    with db.GetEngine().begin() as conn:
+        conn.execute(db.User.__table__.delete().where(db.User.name == 'tim'))
+    assert api.get(NICs, headers=auth).status_code == 403
+
+def test_changes_are_seen_within_the_check_interval(api, auth, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'AUTH_CACHE_CHECK', 3600)
+    assert api.get(NICs, headers=auth).status_code == 200
+    SetPassword('tim', 'marlin456')
+    assert api.get(NICs, headers=auth).status_code == 200 # Not checked yet
+    server.users['next'] = 0.0 # The interval is up
+    assert api.get(NICs, headers=auth).status_code == 403
+
+def test_cache_settings_take_effect_after_import(api, auth, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'AUTH_CACHE_SIZE', 7)
+    api.get(NICs, headers=auth)
+    assert server.credentials().maxsize == 7 and len(server.credentials()) == 1
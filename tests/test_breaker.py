@@ -0,0 +1,120 @@
+"""
+Tests of DRAC.get's retries and circuit breaker, against a stand-in for the HTTP session
+"""
+
+import time
+
+import pytest
+import requests
+
+import client
+
+
+class Response:
+    def __init__(self, status, body=None, headers=None):
+        self.status_code = status
+        self.reason = 'Reason'
+        self.headers = headers or {}
+        self.body = body or {}
+        self.content = b'{}'
+
+    def json(self):
+        return self.body
+
+class Session:
+    """
+    Answers each GET with the next of `outcomes` - a status code, or an exception to raise - repeating the last
+    """
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response(outcome, {'url': url})
+
+def Drac(outcomes, **kwargs):
+    settings = dict(retries=0, breakerthreshold=2, breakercooldown=0.2, backoff=0.001)
+    settings.update(kwargs)
+    drac = client.DRAC('drac1', 'root', 'calvin', **settings)
+    drac.session = Session(outcomes)
+    return drac
+
+Down = requests.exceptions.ConnectionError('Connection refused')
+
+
+def test_opens_after_threshold_failures_in_a_row():
+    drac = Drac([Down])
+    for _ in range(2):
+        with pytest.raises(client.RedfishError) as e:
+            drac.get('/redfish/v1/')
+        assert not isinstance(e.value, client.CircuitOpen)
+    with pytest.raises(client.CircuitOpen):
+        drac.get('/redfish/v1/')
+    assert drac.session.calls == 2 # The open breaker didn't try
+
+def test_success_resets_the_count():
+    drac = Drac([Down, 200, Down, 200])
+    for outcome in (client.RedfishError, None, client.RedfishError, None):
+        if outcome:
+            with pytest.raises(outcome):
+                drac.get('/redfish/v1/')
+        else:
+            drac.get('/redfish/v1/')
+    assert drac.failures == 0 and drac.session.calls == 4
+
+def Open(drac):
+    for _ in range(drac.breakerthreshold):
+        with pytest.raises(client.RedfishError):
+            drac.get('/redfish/v1/')
+    with pytest.raises(client.CircuitOpen):
+        drac.get('/redfish/v1/')
+
+def test_half_open_success_closes():
+    drac = Drac([Down, Down, 200])
+    Open(drac)
+    time.sleep(0.25)
+    assert drac.get('/redfish/v1/Systems') == {'url': drac.url('/redfish/v1/Systems')}
+    assert drac.failures == 0
+    drac.get('/redfish/v1/')
+
+def test_half_open_lets_only_one_request_through():
+    drac = Drac([Down])
+    Open(drac)
+    time.sleep(0.25)
+    drac._checkbreaker('/redfish/v1/') # The trial request
+    with pytest.raises(client.CircuitOpen):
+        drac._checkbreaker('/redfish/v1/') # Nobody else gets through while it's in progress
+
+def test_half_open_failure_reopens():
+    drac = Drac([Down])
+    Open(drac)
+    time.sleep(0.25)
+    with pytest.raises(client.RedfishError) as e:
+        drac.get('/redfish/v1/')
+    assert not isinstance(e.value, client.CircuitOpen) and drac.session.calls == 3
+    with pytest.raises(client.CircuitOpen):
+        drac.get('/redfish/v1/')
+    assert drac.session.calls == 3
+
+def test_client_errors_dont_count():
+    drac = Drac([404])
+    for _ in range(3):
+        with pytest.raises(client.RedfishError) as e:
+            drac.get('/redfish/v1/Nothing')
+        assert e.value.status == 404
+    assert drac.failures == 0 and drac.session.calls == 3
+
+def test_retries_server_errors_within_the_budget():
+    drac = Drac([503, 500, 200], retries=3, breakerthreshold=5)
+    assert drac.get('/redfish/v1/') == {'url': drac.url('/redfish/v1/')}
+    assert drac.session.calls == 3 and drac.retrybudget == 18
+
+def test_gives_up_when_the_budget_is_spent():
+    drac = Drac([500], retries=3, retrybudget=1, breakerthreshold=10)
+    with pytest.raises(client.RedfishError):
+        drac.get('/redfish/v1/')
+    assert drac.session.calls == 2 and drac.retrybudget == 0
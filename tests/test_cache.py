@@ -0,0 +1,86 @@
+"""
+Tests of the API's response cache: server.cached() and its invalidation on writes
+"""
+
+import pytest
+
+import db
+
+Servers = '/inventory/api/v1/servers'
+
+
+@pytest.fixture
+def inventory(database):
+    for n in (1, 2):
+        db.CreateServer({'tag': 'TAG{}'.format(n), 'sid': n, 'stockid': 10 + n})
+    db.CreateNIC({'mac': '08:00:2B:12:34:56', 'sid': 1})
+    db.Session.remove()
+
+def Get(api, auth, path, **headers):
+    return api.get(path, headers=dict(auth, **headers))
+
+
+def test_hit_after_miss_with_the_same_etag(api, auth, inventory):
+    first = Get(api, auth, Servers)
+    second = Get(api, auth, Servers)
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert first.data == second.data
+
+def test_not_modified(api, auth, inventory):
+    etag = Get(api, auth, Servers).headers['ETag']
+    r = Get(api, auth, Servers, **{'If-None-Match': etag})
+    assert r.status_code == 304 and r.headers['ETag'] == etag and not r.data
+
+def test_create_invalidates_the_list(api, auth, inventory):
+    before = Get(api, auth, Servers)
+    r = api.post(Servers, json={'tag': 'TAG3', 'sid': 3, 'stockid': 13}, headers=auth)
+    assert r.status_code == 201
+    after = Get(api, auth, Servers)
+    assert after.headers['X-Cache'] == 'MISS' and after.headers['ETag'] != before.headers['ETag']
+    assert [s['tag'] for s in after.get_json()['server']] == ['TAG1', 'TAG2', 'TAG3']
+    assert Get(api, auth, Servers, **{'If-None-Match': before.headers['ETag']}).status_code == 200
+
+def test_update_invalidates_only_what_it_affects(api, auth, inventory):
+    for path in (Servers, '/inventory/api/v1/server/1', '/inventory/api/v1/server/2', '/inventory/api/v1/nics'):
+        Get(api, auth, path)
+    assert api.put('/inventory/api/v1/server/1', json={'stockid': 99}, headers=auth).status_code == 200
+    r = Get(api, auth, '/inventory/api/v1/server/1')
+    assert r.headers['X-Cache'] == 'MISS' and r.get_json()['server']['stockid'] == 99
+    assert Get(api, auth, Servers).headers['X-Cache'] == 'MISS'
+    assert Get(api, auth, '/inventory/api/v1/server/2').headers['X-Cache'] == 'HIT'
+    assert Get(api, auth, '/inventory/api/v1/nics').headers['X-Cache'] == 'HIT'
+
+def test_nic_write_invalidates_expanded_servers(api, auth, inventory):
+    expanded = '/inventory/api/v1/server/1?expand=nics'
+    assert len(Get(api, auth, expanded).get_json()['server']['nics']) == 1
+    Get(api, auth, '/inventory/api/v1/server/1')
+    r = api.post('/inventory/api/v1/nics', json={'mac': '08:00:2B:12:34:57', 'sid': 1}, headers=auth)
+    assert r.status_code == 201
+    r = Get(api, auth, expanded)
+    assert r.headers['X-Cache'] == 'MISS' and len(r.get_json()['server']['nics']) == 2
+    assert Get(api, auth, '/inventory/api/v1/server/1').headers['X-Cache'] == 'HIT'
+
+def test_delete_invalidates_the_item(api, auth, inventory):
+    assert Get(api, auth, '/inventory/api/v1/server/2').status_code == 200
+    assert api.delete('/inventory/api/v1/server/2', headers=auth).status_code == 200
+    assert Get(api, auth, '/inventory/api/v1/server/2').status_code == 404
+
+def test_errors_and_streams_arent_cached(api, auth, inventory):
+    assert Get(api, auth, '/inventory/api/v1/server/9').status_code == 404
+    db.CreateServer({'tag': 'TAG9', 'sid': 9, 'stockid': 19}) # Behind the API's back
+    db.Session.remove()
+    assert Get(api, auth, '/inventory/api/v1/server/3').status_code == 200
+    r = Get(api, auth, Servers + '?stream=ndjson')
+    assert 'X-Cache' not in r.headers and len(r.data.splitlines()) == 3
+
+def test_settings_take_effect_after_import(api, auth, inventory, monkeypatch):
+    import server
+    monkeypatch.setitem(server.app.config, 'RESPONSE_CACHE_TTL', 0)
+    Get(api, auth, Servers)
+    assert Get(api, auth, Servers).headers['X-Cache'] == 'MISS' # Expired as soon as it was stored
+    monkeypatch.setitem(server.app.config, 'RESPONSE_CACHE_SIZE', 1)
+    monkeypatch.setitem(server.app.config, 'RESPONSE_CACHE_TTL', 60)
+    for path in (Servers, '/inventory/api/v1/nics', Servers):
+        Get(api, auth, path)
+    assert len(server.responses()) == 1 and server.responses().misses == 5
@@ -0,0 +1,110 @@
+"""
+Tests of the change log and the change feed endpoint
+"""
+
+import threading
+import time
+
+import bulk
+import db
+
+Changes = '/inventory/api/v1/changes'
+
+
+def Feed(api, auth, query=''):
+    return api.get(Changes + query, headers=auth)
+
+def Summary(changes):
+    return [(c['version'], c['collection'], c['id'], c['action']) for c in changes]
+
+
+def test_writes_are_versioned(database):
+    server = db.CreateServer({'tag': 'TAG1', 'sid': 1, 'stockid': 11})
+    db.CreateServer({'tag': 'TAG1', 'sid': 2, 'stockid': 12}) # Fails, so isn't logged
+    nic = db.CreateNIC({'mac': '08:00:2B:12:34:56', 'sid': server['id']})
+    db.UpdateServer(server['id'], {'comment': 'Rack 4'})
+    db.UpdateServer(99, {'comment': 'Nobody'})
+    db.DeleteNIC(nic['id'])
+    changes, version = db.GetChanges(0)
+    assert Summary(changes) == [(1, 'servers', 1, 'created'), (2, 'nics', 1, 'created'),
+                                (3, 'servers', 1, 'updated'), (4, 'nics', 1, 'deleted')]
+    assert version == db.LatestVersion() == 4
+    assert changes[2]['record']['comment'] == 'Rack 4' and changes[3]['record'] is None
+    assert db.GetChanges(2) == (changes[2:], 4)
+
+def test_upserts_which_change_nothing_arent_logged(database):
+    db.UpsertServers([{'tag': 'TAG1', 'sid': 1, 'stockid': 11}])
+    db.UpsertNICs([{'mac': '08:00:2B:12:34:56', 'sid': 1}])
+    db.UpsertServers([{'tag': 'TAG1', 'sid': 1}])
+    db.UpsertNICs([{'mac': '08-00-2b-12-34-56', 'sid': 1}])
+    assert db.LatestVersion() == 2
+    db.UpsertNICs([{'mac': '08:00:2B:12:34:56', 'sid': 2}])
+    assert Summary(db.GetChanges(2)[0]) == [(3, 'nics', 1, 'updated')]
+
+def test_changes_after_a_gap_are_held_back(database, monkeypatch):
+    db.CreateServer({'tag': 'TAG1', 'sid': 1, 'stockid': 11})
+    session = db.Session()
+    session.execute(db.Change.__table__.insert(), [{'id': 3, 'collection': 'servers', 'itemid': 1, 'action': 'updated',
+                                                    'time': time.time()}]) # 2 not committed yet
+    session.commit()
+    assert db.GetChanges(0) == (db.GetChanges(0, limit=1)[0], 1)
+    monkeypatch.setattr(db, 'ChangeSettle', 0) # 2 has had long enough, so must have been rolled back
+    assert [c['version'] for c in db.GetChanges(0)[0]] == [1, 3]
+
+def test_plain_imports_are_logged(database, tmp_path):
+    db.CreateServer({'tag': 'TAG1', 'sid': 1, 'stockid': 11})
+    servers = tmp_path / 'servers.csv'
+    servers.write_text('servicetag,sid,stockid\nTAG2,2,12\nTAG3,3,13\n')
+    nics = tmp_path / 'nics.jsonl'
+    nics.write_text('{"id": 7, "sid": 2, "mac": "08:00:2B:12:34:57"}\n{"id": 9, "sid": 3, "mac": "08:00:2B:12:34:58"}\n')
+    ips = tmp_path / 'ips.csv'
+    ips.write_text('nicid,ip\n7,10.0.0.1\n')
+    for table, filename, count in (('servers', servers, 2), ('nics', nics, 2), ('ips', ips, 1)):
+        assert bulk.Import(table, str(filename), batch=1)['imported'] == count
+    assert Summary(db.GetChanges(1)[0]) == [(2, 'servers', 2, 'created'), (3, 'servers', 3, 'created'),
+                                            (4, 'nics', 7, 'created'), (5, 'nics', 9, 'created')]
+
+def test_imports_without_ids_find_the_numbered_rows(database, tmp_path):
+    db.CreateNIC({'mac': '08:00:2B:12:34:56', 'sid': 1})
+    nics = tmp_path / 'nics.csv'
+    nics.write_text('sid,mac\n1,08:00:2B:12:34:56\n2,08:00:2B:12:34:57\n')
+    bulk.Import('nics', str(nics))
+    changes = db.GetChanges(1)[0]
+    assert Summary(changes) == [(2, 'nics', 2, 'created'), (3, 'nics', 3, 'created')]
+    assert [c['record']['mac'] for c in changes] == ['08:00:2B:12:34:56', '08:00:2B:12:34:57']
+
+
+def test_feed(api, auth):
+    assert Feed(api, auth).get_json() == {'change': [], 'version': 0}
+    api.post('/inventory/api/v1/servers', json={'tag': 'TAG1', 'sid': 1, 'stockid': 11}, headers=auth)
+    api.post('/inventory/api/v1/nics', json={'mac': '08:00:2B:12:34:56', 'sid': 1}, headers=auth)
+    rv = Feed(api, auth, '?since=0').get_json()
+    assert rv['version'] == 2
+    assert rv['change'][0]['server'] == {'tag': 'TAG1', 'sid': 1, 'stockid': 11, 'comment': None,
+                                         'uri': '/inventory/api/v1/server/1'}
+    assert rv['change'][1]['nic']['uri'] == '/inventory/api/v1/nic/1'
+    rv = Feed(api, auth, '?since=0&limit=1').get_json()
+    assert len(rv['change']) == 1 and rv['next'] == Changes + '?since=1&limit=1'
+    assert Feed(api, auth, '?since=2').get_json() == {'change': [], 'version': 2}
+
+def test_feed_rejects_bad_arguments(api, auth):
+    assert Feed(api, auth, '?since=0&limit=0').status_code == 400
+    assert Feed(api, auth, '?since=-1').status_code == 400
+    assert Feed(api, auth, '?since=5').status_code == 410 # After the current version
+    assert api.get(Changes).status_code == 403
+
+def test_long_poll_wakes_on_a_write(api, auth):
+    def write():
+        time.sleep(0.3)
+        db.CreateServer({'tag': 'TAG1', 'sid': 1, 'stockid': 11})
+        db.Session.remove()
+    threading.Thread(target=write).start()
+    start = time.monotonic()
+    rv = Feed(api, auth, '?since=0&wait=10').get_json()
+    assert time.monotonic() - start < 2
+    assert Summary(rv['change']) == [(1, 'servers', 1, 'created')]
+
+def test_long_poll_times_out(api, auth):
+    start = time.monotonic()
+    assert Feed(api, auth, '?since=0&wait=0.3').get_json() == {'change': [], 'version': 0}
+    assert time.monotonic() - start >= 0.3
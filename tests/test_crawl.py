@@ -0,0 +1,65 @@
+"""
+Tests that the concurrent crawl of a DRAC finds the same System as the serial one, against a fake DRAC
+(benchmarks/fakeredfish.py)
+"""
+
+import pytest
+
+import client
+from benchmarks.fakeredfish import FakeRedfishServer
+
+NICs = '/redfish/v1/Systems/System.Embedded.1/EthernetInterfaces'
+
+
+@pytest.fixture
+def fake():
+    servers = []
+    def start(**kwargs):
+        servers.append(FakeRedfishServer(cpus=2, nics=6, controllers=2, disks=3, **kwargs).start())
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def Crawl(server, serial, **kwargs):
+    """
+    Crawls the fake DRAC, without the thread pool if `serial`
+    :return: DRAC
+    """
+    drac = client.DRAC('127.0.0.1', 'root', 'calvin', port=server.port, scheme='http', concurrency=8, retries=0, **kwargs)
+    if serial:
+        drac.login()
+        drac._explore()
+    else:
+        drac.explore()
+    drac.close()
+    return drac
+
+
+@pytest.mark.parametrize('expand', [True, False])
+def test_concurrent_crawl_matches_serial(fake, expand):
+    server = fake(expand=expand)
+    serial, concurrent = Crawl(server, True), Crawl(server, False)
+    assert repr(concurrent) == repr(serial)
+    assert list(concurrent.resources()) == list(serial.resources())
+    system = concurrent.systems['System.Embedded.1']
+    assert list(system.nics) == ['NIC.Integrated.1-{}-1'.format(n) for n in range(1, 7)] # In member order
+    assert (len(system.cpus), len(system.storagecontrollers), len(system.disks)) == (2, 2, 6)
+
+def test_a_failed_member_is_left_out(fake):
+    server = fake(expand=False, failing=[NICs + '/NIC.Integrated.1-3-1'])
+    serial, concurrent = Crawl(server, True), Crawl(server, False)
+    assert repr(concurrent) == repr(serial)
+    assert concurrent.errors == serial.errors == 1
+    nics = concurrent.systems['System.Embedded.1'].nics
+    assert list(nics) == ['NIC.Integrated.1-{}-1'.format(n) for n in (1, 2, 4, 5, 6)]
+
+@pytest.mark.parametrize('expand', [True, False])
+def test_a_failed_collection_is_left_out(fake, expand):
+    server = fake(expand=expand, failing=[NICs])
+    serial, concurrent = Crawl(server, True), Crawl(server, False)
+    assert repr(concurrent) == repr(serial)
+    assert concurrent.errors == 1
+    system = concurrent.systems['System.Embedded.1']
+    assert system.nics == {} and len(system.cpus) == 2 and len(system.disks) == 6
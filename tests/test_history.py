@@ -0,0 +1,79 @@
+"""
+Tests of the crawl history store, history.History
+"""
+
+import pytest
+
+import history
+
+CPU = ('System.Embedded.1', 'Processors', 'CPU.Socket.1', {'Model': 'Xeon Gold 6130', 'TotalCores': 16})
+NIC = ('System.Embedded.1', 'EthernetInterfaces', 'NIC.Integrated.1-1-1', {'MACAddress': '08:00:2B:12:34:56'})
+Disk = ('System.Embedded.1', 'SimpleStorage', 'RAID.Integrated.1-1', {'Devices': [{'Name': 'Disk 0'}]})
+
+
+@pytest.fixture
+def store(tmp_path):
+    h = history.History(str(tmp_path / 'history.db'))
+    yield h
+    h.close()
+
+def State(*resources):
+    return {(system, kind, name): attributes for system, kind, name, attributes in resources}
+
+def Changed(nic, mac):
+    return nic[:3] + ({'MACAddress': mac},)
+
+
+def test_identical_resources_are_stored_once(store):
+    assert store.record('drac1', [CPU, NIC], when=10) == {'added': 2, 'changed': 0, 'removed': 0, 'unchanged': 0}
+    assert store.record('drac1', [CPU, NIC], when=20) == {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 2}
+    store.record('drac2', [CPU], when=20) # The same CPU on another host
+    stats = store.stats()
+    assert (stats['hosts'], stats['crawls'], stats['changes'], stats['resources']) == (2, 3, 3, 2)
+
+def test_deltas(store):
+    store.record('drac1', [CPU, NIC], when=10)
+    counts = store.record('drac1', [Changed(NIC, '08:00:2B:12:34:57'), Disk], when=20)
+    assert counts == {'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 0}
+    assert [(c['name'], c['change'], c['attributes']) for c in store.changes(10)] == [
+        ('NIC.Integrated.1-1-1', 'changed', {'MACAddress': '08:00:2B:12:34:57'}),
+        ('RAID.Integrated.1-1', 'added', Disk[3]),
+        ('CPU.Socket.1', 'removed', None)]
+    assert store.crawls('drac1') == [{'time': 10, 'complete': True, 'added': 2, 'changed': 0, 'removed': 0},
+                                     {'time': 20, 'complete': True, 'added': 1, 'changed': 1, 'removed': 1}]
+
+def test_incomplete_crawls_dont_remove_anything(store):
+    store.record('drac1', [CPU, NIC], when=10)
+    assert store.record('drac1', [NIC], when=20, complete=False)['removed'] == 0
+    assert store.state('drac1') == State(CPU, NIC)
+    assert store.record('drac1', [NIC], when=30)['removed'] == 1
+    assert store.state('drac1') == State(NIC)
+
+def test_state_between_crawls(store):
+    store.record('drac1', [CPU], when=10)
+    store.record('drac1', [CPU, NIC], when=20)
+    store.record('drac1', [Changed(NIC, '08:00:2B:12:34:57')], when=30)
+    assert store.state('drac1', 5) == {}
+    assert store.state('drac1', 10) == store.state('drac1', 15) == State(CPU)
+    assert store.state('drac1', 25) == State(CPU, NIC)
+    assert store.state('drac1', 30) == store.state('drac1') == State(Changed(NIC, '08:00:2B:12:34:57'))
+    assert store.state('drac2') == {}
+
+def test_the_last_record_at_the_same_time_wins(store):
+    for n in (1, 2, 3):
+        store.record('drac1', [CPU[:3] + ({'x': n},)], when=20)
+    assert store.state('drac1') == store.state('drac1', 20) == {CPU[:3]: {'x': 3}}
+
+def test_changes_since_until_and_host(store):
+    store.record('drac1', [CPU], when=10)
+    store.record('drac2', [NIC], when=20)
+    store.record('drac1', [CPU, Disk], when=30)
+    assert [(c['host'], c['time']) for c in store.changes(0)] == [('drac1', 10), ('drac2', 20), ('drac1', 30)]
+    assert [(c['host'], c['time']) for c in store.changes(10)] == [('drac2', 20), ('drac1', 30)] # After since
+    assert [(c['host'], c['time']) for c in store.changes(0, 20)] == [('drac1', 10), ('drac2', 20)] # Up to until
+    assert [c['name'] for c in store.changes(0, host='drac1')] == ['CPU.Socket.1', 'RAID.Integrated.1-1']
+    assert store.changes(30) == []
+
+def test_parse_time():
+    assert history.ParseTime('1760000000.5') == 1760000000.5
+    assert history.ParseTime('2026-10-17') == history.ParseTime('2026-10-17T00:00:00+00:00') == 1792195200
@@ -0,0 +1,72 @@
+"""
+Tests of MAC address parsing, db.MACToInt and db.MACPrefixRange, and of the NIC filters
+"""
+
+import warnings
+
+import pytest
+import sqlalchemy.exc
+
+import db
+
+Number = 0x08002B123456
+
+
+@pytest.mark.parametrize('mac', ['08:00:2B:12:34:56', '08:00:2b:12:34:56', '08-00-2B-12-34-56', '0800.2b12.3456',
+                                 '08002B123456', ' 08:00:2B:12:34:56 '])
+def test_usual_forms(mac):
+    assert db.MACToInt(mac) == Number
+
+def test_none():
+    assert db.MACToInt(None) is None
+
+@pytest.mark.parametrize('mac', ['', '08:00:2B:12:34', '08:00:2B:12:34:56:78', '0x1234567890', '+01234567890',
+                                 '00_12_34_56_78_9', '08:00:2B:12:34:5G', '0012345678 9', '08:00:2B*', 12])
+def test_not_macs(mac):
+    with pytest.raises(ValueError):
+        db.MACToInt(mac)
+
+@pytest.mark.parametrize('prefix, first, size', [
+    ('08:00:2B', 0x08002B000000, 1 << 24),
+    ('08-00-2b-1', 0x08002B100000, 1 << 20),
+    ('08:00:2B:12:34:56', Number, 1),
+    ('', 0, 1 << 48),
+])
+def test_prefix_ranges(prefix, first, size):
+    assert db.MACPrefixRange(prefix) == (first, first + size)
+
+@pytest.mark.parametrize('prefix', ['0x', '+1', '08_00', '08:00:2B:12:34:56:7', 'xyzzy'])
+def test_not_prefixes(prefix):
+    with pytest.raises(ValueError):
+        db.MACPrefixRange(prefix)
+
+def test_prefix_range_holds_the_macs_it_starts():
+    first, last = db.MACPrefixRange('08:00:2B')
+    assert first <= Number < last
+    assert not first <= db.MACToInt('08:00:2C:00:00:00') < last
+
+def test_invalid_mac_update_changes_nothing(database):
+    nic = db.CreateNIC({'mac': '08:00:2B:12:34:56', 'sid': 1})
+    with pytest.raises(ValueError):
+        db.UpdateNIC(nic['id'], {'mac': '0x1234567890', 'comment': 'Changed'})
+    db.Session.remove()
+    record = db.Session().query(db.NIC).get(nic['id'])
+    assert (record.mac, record.macnum, record.comment) == ('08:00:2B:12:34:56', Number, None)
+    assert db.GetNICs(mac='08:00:2b:12:34:56')[0]['id'] == nic['id']
+
+@pytest.mark.parametrize('filters, sids', [
+    ({'mac': '08:00:2b:*'}, [1, 2]),
+    ({'tag': 'TAG1'}, [1]),
+    ({'tag': 'TAG*'}, [1, 2]),
+    ({'ip': '10.0.0.2'}, [2]),
+    ({'ip': '10.0.*', 'tag': 'TAG1'}, [1]),
+])
+def test_nic_filters(database, filters, sids):
+    for n in (1, 2):
+        db.CreateServer({'tag': 'TAG{}'.format(n), 'sid': n, 'stockid': 10 + n})
+        nic = db.CreateNIC({'mac': '08:00:2B:12:34:5{}'.format(n), 'sid': n})
+        db.Session().add(db.IP(nicid=nic['id'], ip='10.0.0.{}'.format(n)))
+    db.Session().commit()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', sqlalchemy.exc.SAWarning)
+        assert [n['sid'] for n in db.GetNICs(**filters)] == sids
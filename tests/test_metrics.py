@@ -0,0 +1,93 @@
+"""
+Tests of the metrics shared by the API's gunicorn workers
+"""
+
+import glob
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+import metrics
+
+pytest.importorskip('gunicorn')
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def FreePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def Count(text, route):
+    """
+    Sums api_request_duration_seconds_count over the series for `route`
+    """
+    return sum(int(line.rsplit(None, 1)[1]) for line in text.splitlines()
+               if line.startswith('api_request_duration_seconds_count{') and 'route="{}"'.format(route) in line)
+
+def Get(url):
+    return requests.get(url, headers={'Connection': 'close'}, timeout=10)
+
+
+@pytest.fixture
+def served(database, tmp_path):
+    """
+    serve.py running on the test DB with two workers, sharing their metrics in tmp_path/metrics
+    """
+    port = FreePort()
+    directory = str(tmp_path / 'metrics')
+    process = subprocess.Popen([sys.executable, 'serve.py', '--bind', '127.0.0.1:{}'.format(port), '--workers', '2',
+                                '--threads', '2', '--db', 'sqlite:///{}'.format(tmp_path / 'inventory.db'),
+                                '--metrics-dir', directory, '--metrics-interval', '0.1'], cwd=Root)
+    url = 'http://127.0.0.1:{}'.format(port)
+    try:
+        for _ in range(100):
+            try:
+                if Get(url + '/health').ok and len(glob.glob(os.path.join(directory, '*.json'))) == 2:
+                    break
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.1)
+        else:
+            pytest.fail("serve.py didn't start")
+        yield url, directory
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(30)
+
+
+def test_counters_are_summed_over_the_workers_and_never_go_back(served):
+    url, directory = served
+    time.sleep(0.3) # Both workers have saved their counts
+    base = Count(Get(url + '/metrics').text, '/health')
+    seen = []
+    for _ in range(40):
+        Get(url + '/health')
+        seen.append(Count(Get(url + '/metrics').text, '/health'))
+    assert seen == sorted(seen)
+    time.sleep(0.3)
+    assert {Count(Get(url + '/metrics').text, '/health') for _ in range(10)} == {base + 40}
+    assert len(glob.glob(os.path.join(directory, '*.json'))) == 2
+
+def test_exited_processes_still_count_but_not_their_gauges(tmp_path):
+    registries = []
+    for pid, hits in ((1, 3), (2, 4)):
+        registry = metrics.Registry()
+        requests_total = registry.counter('requests_total', 'Requests', ('route',))
+        registry.callback('entries', 'Cache entries', lambda: 5)
+        registry.directory, registry.filename = str(tmp_path), str(tmp_path / '{}.json'.format(pid))
+        requests_total.inc(hits, route='/health')
+        registry.flush()
+        registries.append(registry)
+    assert 'requests_total{route="/health"} 7\n' in registries[0].render()
+    assert 'entries 10\n' in registries[0].render()
+    metrics.Retire(str(tmp_path), 2)
+    assert 'requests_total{route="/health"} 7\n' in registries[0].render()
+    assert 'entries 5\n' in registries[0].render()
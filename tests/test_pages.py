@@ -0,0 +1,103 @@
+"""
+Tests of the list endpoints' keyset pages and streams, and of db._IterBatches which streams them
+"""
+
+import json
+
+import pytest
+
+import db
+
+Servers = '/inventory/api/v1/servers'
+NICs = '/inventory/api/v1/nics'
+Rows = 2345 # More than a page (server.MaxPageSize) and more than a batch of a stream
+
+
+@pytest.fixture
+def inventory(database):
+    """
+    Rows servers and as many NICs, with gaps in the IDs
+    """
+    with db.GetEngine().begin() as conn:
+        conn.execute(db.Server.__table__.insert(),
+                     [{'servicetag': 'TAG{}'.format(n), 'sid': n, 'stockid': 10000 + n} for n in range(1, Rows + 1)])
+        conn.execute(db.NIC.__table__.insert(),
+                     [{'sid': n % 50, 'mac': '08:00:2B:00:{:02X}:{:02X}'.format(n >> 8, n & 0xff), 'macnum': 0x08002B000000 + n}
+                      for n in range(1, Rows + 1)])
+        conn.execute(db.Server.__table__.delete().where(db.Server.id % 97 == 0))
+        conn.execute(db.NIC.__table__.delete().where(db.NIC.id % 89 == 0))
+
+def Walk(api, auth, path):
+    """
+    Follows the next links from `path`
+    :return: list of rows, number of pages
+    """
+    rows, pages = [], 0
+    while path:
+        r = api.get(path, headers=auth)
+        assert r.status_code == 200
+        body = r.get_json()
+        key = 'server' if 'server' in body else 'nic'
+        rows.extend(body[key])
+        pages += 1
+        path = body.get('next')
+    return rows, pages
+
+def All(api, auth, path):
+    body = api.get(path, headers=auth).get_json()
+    return body['server'] if 'server' in body else body['nic']
+
+
+@pytest.mark.parametrize('path, query', [
+    (Servers, ''),
+    (Servers, 'tag=TAG1*&'),
+    (NICs, ''),
+    (NICs, 'sid=7&'),
+    (NICs, 'mac=08:00:2B:00:04:*&'),
+])
+@pytest.mark.parametrize('limit', [1000, 300, 45])
+def test_pages_add_up_to_the_list(api, auth, inventory, path, query, limit):
+    everything = All(api, auth, '{}?{}'.format(path, query).rstrip('&?'))
+    assert everything
+    rows, pages = Walk(api, auth, '{}?{}after=0&limit={}'.format(path, query, limit))
+    assert rows == everything
+    assert pages == len(everything) // limit + 1
+
+def test_next_links(api, auth, inventory):
+    body = api.get(Servers + '?tag=TAG1*&limit=5', headers=auth).get_json()
+    assert body['next'] == '{}?after={}&limit=5&tag=TAG1*'.format(Servers, db.GetServers(tag='TAG1*', limit=5)[-1]['id'])
+    last = db.GetServers()[-1]['id']
+    body = api.get('{}?after={}&limit=5'.format(Servers, last - 1), headers=auth).get_json()
+    assert len(body['server']) == 1 and 'next' not in body
+    assert api.get('{}?after={}'.format(Servers, last), headers=auth).get_json() == {'server': []}
+
+def test_pages_are_capped(api, auth, inventory):
+    body = api.get(Servers + '?limit=5000', headers=auth).get_json()
+    assert len(body['server']) == 1000 and body['next'].endswith('limit=1000')
+    assert len(api.get(Servers + '?after=0', headers=auth).get_json()['server']) == 1000
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=-1', 'limit=ten', 'after=x', 'stream=xml'])
+@pytest.mark.parametrize('path', [Servers, NICs])
+def test_bad_arguments(api, auth, database, path, query):
+    assert api.get('{}?{}'.format(path, query), headers=auth).status_code == 400
+
+@pytest.mark.parametrize('path', [Servers, NICs, Servers + '?tag=TAG2*', NICs + '?sid=7'])
+def test_streams_match_the_list(api, auth, inventory, path):
+    everything = All(api, auth, path)
+    separator = '&' if '?' in path else '?'
+    r = api.get(path + separator + 'stream=json', headers=auth)
+    assert r.mimetype == 'application/json'
+    assert json.loads(r.get_data(as_text=True)) == json.loads(api.get(path, headers=auth).get_data(as_text=True))
+    r = api.get(path + separator + 'stream=ndjson', headers=auth)
+    assert r.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in r.get_data(as_text=True).splitlines()] == everything
+    after = everything[len(everything) // 2]['uri'].rsplit('/', 1)[1]
+    r = api.get(path + separator + 'stream=ndjson&after=' + after, headers=auth)
+    assert [json.loads(line) for line in r.get_data(as_text=True).splitlines()] == everything[len(everything) // 2 + 1:]
+
+@pytest.mark.parametrize('batch', [1, 7, 96, 1000, 5000])
+def test_batches_run_on_from_each_other(inventory, batch):
+    assert list(db.IterServers(batch=batch)) == db.GetServers()
+    assert list(db.IterNICs(batch=batch, sid=3)) == db.GetNICs(sid=3)
+    middle = db.GetNICs()[1000]['id']
+    assert list(db.IterNICs(after=middle, batch=batch)) == db.GetNICs(after=middle)
@@ -0,0 +1,78 @@
+"""
+Tests that the API's GET endpoints take the minimum number of SQL statements, as reported in X-Query-Count
+"""
+
+import pytest
+
+import db
+import server
+
+
+@pytest.fixture
+def inventory(database):
+    """
+    Two servers, each with two NICs of two IP addresses
+    """
+    session = db.Session()
+    for s in (1, 2):
+        db.CreateServer({'tag': 'TAG{}'.format(s), 'sid': s, 'stockid': 10 + s})
+        for n in (1, 2):
+            nic = db.CreateNIC({'mac': '08:00:2B:12:3{}:5{}'.format(s, n), 'sid': s})
+            session.add_all([db.IP(nicid=nic['id'], ip='10.{}.{}.{}'.format(s, n, i)) for i in (1, 2)])
+    session.commit()
+    db.Session.remove()
+
+@pytest.fixture
+def signedin(api, auth, inventory, monkeypatch):
+    """
+    The test client with the credentials already verified, so that authentication takes no statements
+    """
+    monkeypatch.setitem(server.app.config, 'AUTH_CACHE_CHECK', 3600)
+    assert api.get('/inventory/api/v1/nic/99', headers=auth).status_code == 404
+    return api
+
+def Count(api, auth, path):
+    r = api.get(path, headers=auth)
+    assert r.status_code in (200, 404)
+    return int(r.headers['X-Query-Count'])
+
+
+@pytest.mark.parametrize('path', [
+    '/inventory/api/v1/servers',
+    '/inventory/api/v1/servers?after=1&limit=1',
+    '/inventory/api/v1/servers?tag=TAG*',
+    '/inventory/api/v1/server/1',
+    '/inventory/api/v1/server/99',
+    '/inventory/api/v1/server/1?expand=nics',
+    '/inventory/api/v1/server/1?expand=nics.ips',
+    '/inventory/api/v1/nics',
+    '/inventory/api/v1/nics?after=1&limit=2',
+    '/inventory/api/v1/nics?mac=08:00:2B:12:31:*',
+    '/inventory/api/v1/nics?tag=TAG2',
+    '/inventory/api/v1/nics?ip=10.1.2.*',
+    '/inventory/api/v1/nic/1',
+])
+def test_one_statement(signedin, auth, path):
+    assert Count(signedin, auth, path) == 1
+
+def test_expanded_trees_dont_grow_with_the_rows(signedin, auth):
+    session = db.Session()
+    for n in range(3, 10):
+        nic = db.CreateNIC({'mac': '08:00:2B:12:31:5{}'.format(n), 'sid': 1})
+        session.add(db.IP(nicid=nic['id'], ip='10.1.{}.1'.format(n)))
+    session.commit()
+    db.Session.remove()
+    r = signedin.get('/inventory/api/v1/server/1?expand=nics.ips', headers=auth)
+    assert r.headers['X-Query-Count'] == '1'
+    nics = r.get_json()['server']['nics']
+    assert len(nics) == 9 and sum(len(n['ips']) for n in nics) == 11
+
+def test_cache_hits_take_none(signedin, auth):
+    assert Count(signedin, auth, '/inventory/api/v1/server/1?expand=nics.ips') == 1
+    assert Count(signedin, auth, '/inventory/api/v1/server/1?expand=nics.ips') == 0
+
+def test_authentication(api, auth, inventory, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'AUTH_CACHE_CHECK', 3600)
+    # The first request reads the users table's version and the password, later ones neither
+    assert Count(api, auth, '/inventory/api/v1/nic/1') == 3
+    assert Count(api, auth, '/inventory/api/v1/nic/2') == 1
@@ -0,0 +1,124 @@
+"""
+Tests of client.Scheduler: skipping unchanged hosts, the crawl rate limit and retrying failed syncs, with a
+stand-in for the DRAC
+"""
+
+import threading
+import time
+
+import pytest
+
+import client
+
+
+class StubDRAC:
+    """
+    Finds what `found` says is on its host: a string, or a function returning one
+    """
+    found = {}
+    starts = []
+
+    def __init__(self, host, user, password, **kwargs):
+        self.host = host
+        self.systems = {}
+        self.errors = 0
+        StubDRAC.starts.append((time.monotonic(), host))
+
+    def explore(self):
+        found = StubDRAC.found.get(self.host, 'Nothing')
+        self.systems = {'System.Embedded.1': found() if callable(found) else found}
+
+    def close(self):
+        pass
+
+    def cancel(self):
+        pass
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(client, 'DRAC', StubDRAC)
+    monkeypatch.setattr(StubDRAC, 'found', {})
+    monkeypatch.setattr(StubDRAC, 'starts', [])
+    return StubDRAC
+
+def Run(scheduler, seconds):
+    thread = threading.Thread(target=scheduler.run, kwargs={'progress': 3600})
+    thread.start()
+    time.sleep(seconds)
+    scheduler.stop()
+    thread.join(10)
+    assert not thread.is_alive()
+
+class Sync:
+    def __init__(self, fail=0):
+        self.fail = fail # Number of calls to fail
+        self.calls = []
+        self.dracs = []
+
+    def __call__(self, dracs):
+        self.calls.append(sorted(d.host for d in dracs))
+        self.dracs.append(list(dracs))
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError('Inventory unreachable')
+
+
+def test_unchanged_hosts_arent_synced(stub):
+    counter = iter(range(1000))
+    stub.found.update({'steady': 'CPU 1', 'busy': lambda: 'CPU {}'.format(next(counter))})
+    sync = Sync()
+    scheduler = client.Scheduler(['steady', 'busy'], 'root', 'calvin', interval=0.05, hotinterval=0.05, jitter=0,
+                                 sync=sync, syncinterval=0)
+    Run(scheduler, 2.0) # run() checks what's due every half a second or so
+    crawls = [host for _, host in stub.starts]
+    assert crawls.count('steady') >= 3 and crawls.count('busy') >= 3
+    synced = [host for call in sync.calls for host in call]
+    assert synced.count('steady') == 1 # Its first crawl
+    assert synced.count('busy') == crawls.count('busy')
+    assert scheduler.state.get('steady')['lastchange'] is None and scheduler.state.get('busy')['lastchange']
+
+def test_crawls_are_rate_limited(stub):
+    hosts = ['drac{}'.format(n) for n in range(50)]
+    scheduler = client.Scheduler(hosts, 'root', 'calvin', workers=2, rate=240) # Bursts of 2, then 4 a second
+    Run(scheduler, 2.0)
+    starts = [t for t, _ in stub.starts]
+    assert 6 <= len(starts) <= 2 + 4 * 2
+    for i, first in enumerate(starts): # No window has more starts than the budget allows
+        for window in (0.25, 0.5, 1.0):
+            assert len([t for t in starts[i:] if t - first <= window]) <= 2 + 4 * window
+    assert len(set(host for _, host in stub.starts)) == len(starts) # Nobody crawled twice, as nobody's due again
+
+def test_failed_sync_is_retried(stub):
+    sync = Sync(fail=1)
+    scheduler = client.Scheduler(['drac1', 'drac2'], 'root', 'calvin', sync=sync)
+    for host in ('drac1', 'drac2'):
+        drac = client.DRAC(host, 'root', 'calvin')
+        drac.explore()
+        scheduler._record(host, drac, time.monotonic(), 'ok', None)
+    scheduler.flush()
+    assert sync.calls == [['drac1', 'drac2']]
+    assert [d.host for d in scheduler.changed] == ['drac1', 'drac2'] # Kept for the next flush
+    assert scheduler.state.get('drac1')['fingerprint'] is None # So it's synced after a restart, too
+
+    drac = client.DRAC('drac1', 'root', 'calvin') # drac1 is crawled again before the next flush
+    drac.explore()
+    fingerprint = client.Scheduler.fingerprint(drac)
+    scheduler._record('drac1', drac, time.monotonic(), 'ok', None)
+    scheduler.flush()
+    assert sync.calls[1:] == [['drac1', 'drac2']] # Once each
+    assert drac in sync.dracs[1] # drac1's latest crawl
+    assert scheduler.changed == []
+    assert scheduler.state.get('drac1')['fingerprint'] == fingerprint
+    assert scheduler.state.get('drac2')['fingerprint'] is not None
+
+def test_sync_which_keeps_failing_keeps_the_hosts(stub):
+    sync = Sync(fail=3)
+    scheduler = client.Scheduler(['drac1'], 'root', 'calvin', sync=sync)
+    drac = client.DRAC('drac1', 'root', 'calvin')
+    drac.explore()
+    scheduler._record('drac1', drac, time.monotonic(), 'ok', None)
+    for _ in range(3):
+        scheduler.flush()
+    assert sync.calls == [['drac1']] * 3 and scheduler.changed == [drac]
+    scheduler.flush()
+    assert len(sync.calls) == 4 and scheduler.changed == [] and drac.systems == {}
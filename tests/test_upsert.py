@@ -0,0 +1,107 @@
+"""
+Tests of the bulk upserts, db.UpsertServers and db.UpsertNICs
+"""
+
+import pytest
+import sqlalchemy.exc
+
+import db
+
+
+def Statuses(results):
+    return [r['status'] for r in results]
+
+def FailOnce(monkeypatch):
+    """
+    Makes the first write to the change log fail as if another writer had got in first, so that the
+    upsert falls back to applying its items one at a time
+    """
+    log = db._LogChanges
+    calls = []
+    def fail(session, collection, action, ids):
+        if not calls:
+            calls.append(ids)
+            raise sqlalchemy.exc.IntegrityError('INSERT', {}, Exception('Duplicate entry'))
+        return log(session, collection, action, ids)
+    monkeypatch.setattr(db, '_LogChanges', fail)
+
+
+def test_servers_created_then_updated(database):
+    results = db.UpsertServers([{'tag': 'ABC123', 'sid': 1, 'stockid': 11}, {'tag': 'XYZ123', 'sid': 2, 'stockid': 12}])
+    assert Statuses(results) == ['created', 'created']
+    assert db.GetServer(results[0]['id'])['tag'] == 'ABC123'
+
+    results = db.UpsertServers([{'tag': 'ABC123', 'comment': 'Rack 4'}, {'tag': 'NEW1', 'sid': 3, 'stockid': 13}])
+    assert Statuses(results) == ['updated', 'created']
+    server = db.GetServers(tag='ABC123')[0]
+    assert server['comment'] == 'Rack 4' and server['sid'] == 1
+
+def test_server_conflicts_dont_stop_the_batch(database):
+    db.UpsertServers([{'tag': 'ABC123', 'sid': 1, 'stockid': 11}])
+    results = db.UpsertServers([
+        {'sid': 5, 'stockid': 15},                    # No tag
+        {'tag': 'NEW1', 'sid': 6},                    # New, but no stock ID
+        {'tag': 'NEW2', 'sid': 1, 'stockid': 16},     # SID belongs to ABC123
+        {'tag': 'NEW3', 'sid': 7, 'stockid': 17},
+        {'tag': 'new3', 'sid': 8, 'stockid': 18},     # Repeats NEW3
+    ])
+    assert Statuses(results) == ['conflict', 'conflict', 'conflict', 'created', 'conflict']
+    assert 'ABC123' in results[2]['error']
+    assert [s['tag'] for s in db.GetServers()] == ['ABC123', 'NEW3']
+
+@pytest.mark.parametrize('item, error', [
+    ({'tag': 5, 'sid': 1, 'stockid': 11}, 'tag must be a string'),
+    ({'tag': 'ABC123', 'sid': 'abc', 'stockid': 11}, 'sid must be an integer'),
+    ({'tag': 'ABC123', 'sid': True, 'stockid': 11}, 'sid must be an integer'),
+    ({'tag': 'ABC123', 'sid': 1, 'stockid': 2**40}, 'stockid is out of range'),
+    ({'tag': 'ABC1234567890', 'sid': 1, 'stockid': 11}, 'tag is longer than 10 characters'),
+    ({'tag': 'ABC123', 'sid': 1, 'stockid': 11, 'comment': ['x']}, 'comment must be a string'),
+    ('ABC123', 'Not an object'),
+])
+def test_server_values_are_type_checked(database, item, error):
+    results = db.UpsertServers([item, {'tag': 'GOOD1', 'sid': '9', 'stockid': 19}])
+    assert results[0] == {'tag': item.get('tag') if isinstance(item, dict) else None, 'status': 'conflict', 'error': error}
+    assert results[1]['status'] == 'created'
+    assert [(s['tag'], s['sid']) for s in db.GetServers()] == [('GOOD1', 9)]
+
+def test_servers_fall_back_to_one_at_a_time(database, monkeypatch):
+    db.UpsertServers([{'tag': 'ABC123', 'sid': 1, 'stockid': 11}])
+    FailOnce(monkeypatch)
+    results = db.UpsertServers([{'tag': 'ABC123', 'comment': 'Moved'}, {'tag': 'NEW1', 'sid': 2, 'stockid': 12},
+                                {'tag': 'NEW2', 'sid': 1, 'stockid': 13}])
+    assert Statuses(results) == ['updated', 'created', 'conflict']
+    assert {s['tag']: s['comment'] for s in db.GetServers()} == {'ABC123': 'Moved', 'NEW1': None}
+
+
+def test_nics_matched_on_mac(database):
+    results = db.UpsertNICs([{'mac': '08:00:2B:12:34:56', 'sid': 1}, {'mac': '08:00:2B:12:34:57', 'sid': 1}])
+    assert Statuses(results) == ['created', 'created']
+    results = db.UpsertNICs([{'mac': '08-00-2b-12-34-56', 'sid': 2, 'comment': 'Moved'}])
+    assert results == [{'mac': '08-00-2b-12-34-56', 'status': 'updated', 'id': 1}]
+    assert [(n['sid'], n['comment']) for n in db.GetNICs()] == [(2, 'Moved'), (1, None)]
+
+@pytest.mark.parametrize('item, error', [
+    ({'mac': '08:00:2B:12:34:56'}, 'mac and sid are mandatory'),
+    ({'mac': 12, 'sid': 1}, 'mac must be a string'),
+    ({'mac': '08:00:2B:12:34:56', 'sid': 'abc'}, 'sid must be an integer'),
+    ({'mac': '0x1234567890', 'sid': 1}, "0x1234567890 isn't a MAC address"),
+    ({'mac': '08:00:2B:12:34:56:78:9A', 'sid': 1}, 'mac is longer than 17 characters'),
+])
+def test_nic_values_are_checked(database, item, error):
+    results = db.UpsertNICs([item, {'mac': '08:00:2B:00:00:01', 'sid': '3'}])
+    assert results[0] == {'mac': item.get('mac'), 'status': 'conflict', 'error': error}
+    assert results[1]['status'] == 'created'
+    assert [(n['mac'], n['sid']) for n in db.GetNICs()] == [('08:00:2B:00:00:01', 3)]
+
+def test_nic_repeated_in_batch(database):
+    results = db.UpsertNICs([{'mac': '08:00:2B:12:34:56', 'sid': 1}, {'mac': '0800.2b12.3456', 'sid': 2}])
+    assert Statuses(results) == ['created', 'conflict']
+    assert results[1]['error'] == 'Duplicate MAC in batch'
+
+def test_nics_fall_back_to_one_at_a_time(database, monkeypatch):
+    db.UpsertNICs([{'mac': '08:00:2B:12:34:56', 'sid': 1}])
+    FailOnce(monkeypatch)
+    results = db.UpsertNICs([{'mac': '08:00:2B:12:34:56', 'sid': 2}, {'mac': 'bad', 'sid': 1},
+                             {'mac': '08:00:2B:12:34:57', 'sid': 1}])
+    assert Statuses(results) == ['updated', 'conflict', 'created']
+    assert [(n['mac'], n['sid']) for n in db.GetNICs()] == [('08:00:2B:12:34:56', 2), ('08:00:2B:12:34:57', 1)]